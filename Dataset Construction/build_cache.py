@@ -0,0 +1,87 @@
+# Incremental rebuild of the per annotation set outputs of main.py
+#
+# process() only depends on the intermediary annotation files of one annotation set (data/D-ESX-X/)
+# and on the label config (the label_schema.LabelSchema it was processed with), so
+# its results are saved per set in build_cache/<set>/:
+#   manifest.json  -> {"inputs": hash of the set's annotation files, "config": the label config}
+#   consensus/     -> the consensus label matrix and reflections_new, as a dataset artifact
+#                     (see Shared/dataset_artifact.py)
+#   label_sets.csv -> the label sets of every reflection (see Shared/label_set_encoding.py)
+# On the next run, a set whose manifest still matches is loaded from here instead of going through
+# process() again, and its results are spliced into full_dataset.csv/label_sets.csv like a fresh one.
+# Delete build_cache/ to force a full rebuild
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+import dataset_artifact
+import label_set_encoding
+
+BUILD_CACHE = "build_cache"
+
+
+# Hash of every annotation file of an annotation set (names and contents), in sorted order
+def set_digest(files):
+    digest = hashlib.sha256()
+    for file in sorted(files, key=str):
+        digest.update(os.path.basename(file).encode("utf-8") + b"\0")
+        with open(file, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def _manifest_path(set_name):
+    return f"{BUILD_CACHE}/{set_name}/manifest.json"
+
+
+# Returns the package process() would return for set_name, or None if the set has not been built
+# with these exact inputs and label config before
+# METHOD PARAMETERS
+# inputs: set_digest() of the set's annotation files
+# config: LabelSchema.config() of the current run
+def load_package(set_name, inputs, config):
+    try:
+        with open(_manifest_path(set_name), "r", encoding="utf-8") as m:
+            manifest = json.load(m)
+    except (OSError, ValueError):
+        return None
+    if manifest != {"inputs": inputs, "config": config}:
+        return None
+
+    consensus = dataset_artifact.DatasetArtifact(f"{BUILD_CACHE}/{set_name}/consensus")
+    label_sets = label_set_encoding.read_label_sets(f"{BUILD_CACHE}/{set_name}/label_sets.csv")
+    offsets = label_sets.offsets.tolist()
+    annotators = label_sets.annotators.tolist()
+    masks = label_sets.masks.tolist()
+    return [consensus.texts(),
+            [[label_sets.texts[i], annotators[offsets[i]:offsets[i+1]], masks[offsets[i]:offsets[i+1]]]
+             for i in range(0, len(label_sets))],
+            np.array(consensus.matrix)]
+
+
+# Save the package process() returned for set_name (see load_package())
+def save_package(set_name, package, inputs, config):
+    path = f"{BUILD_CACHE}/{set_name}"
+    # the manifest goes first and comes back last, so an interrupted save is never mistaken for a valid one
+    if os.path.exists(_manifest_path(set_name)):
+        os.remove(_manifest_path(set_name))
+    os.makedirs(path, exist_ok=True)
+
+    labels = config["labels"]
+    dataset_artifact.write_artifact(f"{path}/consensus", package[2], package[0], labels)
+    label_set_encoding.write_label_sets(f"{path}/label_sets.csv", package[1], labels)
+    with open(_manifest_path(set_name), "w", encoding="utf-8") as m:
+        json.dump({"inputs": inputs, "config": config}, m)
+
+
+# Remove the cached results of annotation sets that are no longer in data/
+def prune(set_names):
+    if not os.path.isdir(BUILD_CACHE):
+        return
+    for cached in os.listdir(BUILD_CACHE):
+        if cached not in set_names:
+            shutil.rmtree(f"{BUILD_CACHE}/{cached}", ignore_errors=True)
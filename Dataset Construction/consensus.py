@@ -0,0 +1,155 @@
+# Batched consensus labeling engine used by process() in main.py
+#
+# Instead of resolving consensus labels one reflection at a time with Python lists and Counters,
+# every annotation file is encoded into flat integer arrays once:
+#   ref_ids[k]   -> which reflection the k-th (deduplicated) label belongs to
+#   set_ids[k]   -> which annotator label set the k-th label belongs to
+#   label_ids[k] -> the encoded label itself
+# plus set_annotators[s] -> the annotator (annotation file) label set s came from
+# and the mean label set length and top n labels for every reflection are then computed with
+# numpy bincount/lexsort in a single pass over those arrays.
+
+import csv
+from functools import lru_cache
+
+import numpy as np
+
+import reflection_store
+
+
+# Iteration order of list(set(labels)) for a tuple of distinct labels (in the order they were
+# first written by the annotator). The old process() built every label set with list(set(...)),
+# and the tie-breaking in Counter.most_common() depended on that order, so we reproduce it exactly.
+# There are only a handful of distinct label combinations in a dataset, so caching makes this
+# effectively free.
+@lru_cache(maxsize=None)
+def _set_order(labels):
+    return tuple(set(labels))
+
+
+# METHOD PARAMETERS
+# files: the intermediary annotation files generated by organize.py, each row is (reflection, label)
+# schema: the label_schema.LabelSchema labels are encoded with (excluded labels are dropped)
+# RETURNS
+# reflections: every reflection in order of first appearance
+# ref_ids, set_ids, label_ids: flat integer arrays (see top of file), excluded labels and duplicate
+#   labels within a label set are already dropped, and labels within each label set are in set order
+# set_annotators: annotator id of every label set, the position of its file among the sorted file names
+def encode_annotations(files, schema):
+    # issues in exclude_labels (and anything that isn't a label) are encoded as the next consecutive
+    # integer and removed
+    excluded = schema.excluded_id
+
+    files = list(files)
+    annotator_ids = {file: i for i, file in enumerate(sorted(files, key=str))}
+
+    store = reflection_store.ReflectionStore()  # reflection id == position in reflections
+    ref_ids = []
+    set_ids = []
+    label_ids = []
+    set_annotators = []
+
+    # every consecutive run of rows with the same reflection in an annotation file is one label set,
+    # the same way the old process() grouped rows
+    set_id = -1
+    for file in files:
+        with open(file, "r", encoding="utf-8") as annotation:
+            rows = list(csv.reader(annotation))
+        if not rows:
+            continue
+        texts = np.array([row[0] for row in rows], dtype=object)
+        labels = schema.encode([row[1] for row in rows])
+
+        starts = np.ones(len(texts), dtype=bool)
+        starts[1:] = texts[1:] != texts[:-1]
+        run_refs = store.intern_all(texts[starts])
+
+        runs = np.cumsum(starts) - 1
+        keep = labels != excluded
+        ref_ids.append(run_refs[runs[keep]])
+        set_ids.append(runs[keep] + set_id + 1)
+        label_ids.append(labels[keep])
+        set_annotators.extend([annotator_ids[file]] * len(run_refs))
+        set_id += len(run_refs)
+
+    set_annotators = np.array(set_annotators, dtype=np.int64)
+    reflections = store.texts
+    if not label_ids:
+        empty = np.zeros(0, dtype=np.int64)
+        return reflections, empty, empty, empty, set_annotators
+
+    ref_ids = np.concatenate(ref_ids)
+    set_ids = np.concatenate(set_ids)
+    label_ids = np.concatenate(label_ids)
+
+    # drop duplicate labels within a label set, keeping the first occurrence (set_ids are sorted, so
+    # stable sorting by (set, label) keeps everything grouped by label set)
+    order = np.lexsort((label_ids, set_ids))
+    pair = set_ids[order] * excluded + label_ids[order]
+    first = np.ones(len(pair), dtype=bool)
+    first[1:] = pair[1:] != pair[:-1]
+    unique = np.sort(order[first])  # back to file order
+    ref_ids, set_ids, label_ids = ref_ids[unique], set_ids[unique], label_ids[unique]
+
+    # reorder labels inside each label set into set order
+    bounds = np.flatnonzero(np.diff(set_ids)) + 1
+    label_ids = np.concatenate([_set_order(tuple(chunk.tolist())) for chunk in np.split(label_ids, bounds)])
+
+    return reflections, ref_ids, set_ids, label_ids.astype(np.int64), set_annotators
+
+
+# Resolve every reflection's label sets to its consensus labels (see CONSENSUS LABELING METHODOLOGY
+# in main.py). n is the rounded mean label set length, and the top n labels are the n most frequent
+# ones; ties are broken by which label shows up first across the label sets, which is what
+# Counter.most_common() did before.
+# RETURNS a (num_reflections x num_labels) int8 matrix of consensus labels, where reflections whose
+# labels were all excluded are rows of zeroes
+def consensus_matrix(num_reflections, ref_ids, set_ids, label_ids, num_labels):
+    matrix = np.zeros((num_reflections, num_labels), dtype=np.int8)
+    if len(label_ids) == 0:
+        return matrix
+
+    # mean label set length for every reflection; empty label sets were already dropped with the
+    # excluded labels so they don't count towards the mean
+    set_refs = np.zeros(set_ids.max() + 1, dtype=np.int64)
+    set_refs[set_ids] = ref_ids
+    nonempty_sets = np.bincount(set_refs[np.unique(set_ids)], minlength=num_reflections)
+    total_labels = np.bincount(ref_ids, minlength=num_reflections)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        n = np.round(total_labels / np.maximum(nonempty_sets, 1)).astype(np.int64)
+
+    # tally every (reflection, label) pair and remember where it first appeared
+    keys = ref_ids * num_labels + label_ids
+    counts = np.bincount(keys, minlength=num_reflections * num_labels)
+    present, first_seen = np.unique(keys, return_index=True)
+
+    # rank the labels of each reflection by count (descending) then first appearance, keep the top n
+    ref_of_key = present // num_labels
+    order = np.lexsort((first_seen, -counts[present], ref_of_key))
+    ranked = present[order]
+    ranked_refs = ref_of_key[order]
+    group_start = np.searchsorted(ranked_refs, ranked_refs, side="left")
+    rank = np.arange(len(ranked)) - group_start
+    top = ranked[rank < n[ranked_refs]]
+
+    matrix[top // num_labels, top % num_labels] = 1
+    return matrix
+
+
+# Per-reflection label sets for label_sets.csv: for every reflection, the annotator ids and label bitmasks
+# (bit i set == label i, see Shared/label_set_encoding.py) of its non-empty label sets
+def label_masks_by_reflection(num_reflections, ref_ids, set_ids, label_ids, set_annotators):
+    annotators = [[] for _ in range(num_reflections)]
+    masks = [[] for _ in range(num_reflections)]
+    if len(label_ids) == 0:
+        return annotators, masks
+    # labels are unique within a label set, so summing their bits gives the set's mask
+    set_masks = np.bincount(set_ids, weights=np.left_shift(1, label_ids), minlength=len(set_annotators))
+    present = np.unique(set_ids)
+    set_refs = np.zeros(len(set_annotators), dtype=np.int64)
+    set_refs[set_ids] = ref_ids
+    for ref, annotator, mask in zip(set_refs[present].tolist(), set_annotators[present].tolist(),
+                                    set_masks[present].astype(np.int64).tolist()):
+        annotators[ref].append(annotator)
+        masks[ref].append(mask)
+    return annotators, masks
@@ -11,68 +11,35 @@
 # just less of a pain to do these first steps manually
 
 import csv
+from concurrent.futures import ProcessPoolExecutor
+import sys
 import pandas as pd
 import numpy as np
-from collections import Counter
-import organize
 from pathlib import Path
 import os, os.path
 
-
-# there might be a cleaner way to do the following that doesn't involve
-# 2 dicts but this works
-issue2integer = {
-    "None": 0,
-    "Python and Coding": 1,
-    "Github": 2,
-    "MySQL": 3,
-    "Assignments": 4,
-    "Quizzes": 5,
-    "Understanding requirements and instructions": 6,
-    "Learning New Material": 7,
-    "Course Structure and Materials": 8,
-    "Time Management and Motivation": 9,
-    "Group Work": 10,
-    "IDE and Package Installation": 11,
-    "API": 12,
-    "FastAPI": 12,
-    "Personal Issue": 13,
-    "HTML": 14,
-    "SDLC": 15,
-}
-
-integer2issue = {
-    0: "None",
-    1: "Python and Coding",
-    2: "Github",
-    3: "MySQL",
-    4: "Assignments",
-    5: "Quizzes",
-    6: "Understanding requirements and instructions",
-    7: "Learning New Material",
-    8: "Course Structure and Materials",
-    9: "Time Management and Motivation",
-    10: "Group Work",
-    11: "IDE and Package Installation",
-    12: "API",
-    13: "Personal Issue",
-    14: "HTML",
-    15: "SDLC",
-}
-
-primary_labels = []
+# modules shared between every stage of the pipeline live in Shared/ at the top of the repository
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Shared"))
+import dataset_artifact
+import label_set_encoding
+import label_schema
+import reflection_store
+import consensus
+import build_cache
+import organize
 
 
 # METHOD PARAMETERS
 # files: the intermediary annotations obtained from the datasets in raw_data, generated in organize.py
 # output_file: name to assign to file which contains the final consensus dataset
+# schema: label_schema.LabelSchema with the labels to keep
 # include_other: whether or not to include the "other" column. If not, any reflection with the "other"
 #   label will remain in the dataset, just stripped of the "other" label
-def process(files, output_file, dataset_name):
+def process(files, output_file, dataset_name, schema):
     print(f"Processing files in {dataset_name}...\n")
     # CONSENSUS LABELING METHODOLOGY
     # **************************************
-    # data will be a dictionary where each reflection is mapped to a set of every label
+    # each reflection is mapped to a set of every label
     # assigned to it by every labeler that labeled that reflection. e.g. [0,0,0,1,1,2]
     # where 0 == Python and Coding, 1 == GitHub, and 2 == Assignments, though label-integer
     # mapping depend on what labels are excluded. After every label for every reflection has been
@@ -85,120 +52,34 @@ def process(files, output_file, dataset_name):
     # so for that example, the consensus label set would be [0,1] or [0,3] (both are assumed to be
     # equally valid. top_n_labels keeps track of the length of each individual label set to determine n.
     # **************************************
-    data = {}
-
-    # keeping track of all reflections w/o duplicates to add to
-    # final processed dataset.
-    # reflections instantiated every time a new
-    # reflection is iterated over, except for the first one
-    # which is added in a special case
-    reflections = []
-
-    # Iterate through all annotation files, encode the labels to integers, and concatenate the single-label rows into
-    # label lists for each reflection
-    for file in files:
-        with open(file, "r", encoding="utf-8") as annotation:
-            c_r = csv.reader(annotation)
-            c_r = list(c_r)
-            # replace issue strings with mapped integers
-            for i in range(0, len(c_r)):
-                if c_r[i][1] in issue2integer.keys() and c_r[i][1] != "Other":
-                    c_r[i][1] = issue2integer[c_r[i][1].strip()]
-                else:
-                    c_r[i][1] = max(list(issue2integer.values()))+1  # issues in exclude_labels will be mapped to next consecutive integer
-                    # and be removed later
-                    # (16 in case of no excluded labels)
-            c_r.append(["", -1])  # dummy list entry, so the last reflection is included in the loop below
-            current_reflection = c_r[0][0]
-            reflection_labels = []  # n labels chosen by annotator for that reflection
-            i = 0
-            for row in c_r:
-                # row[0] == reflection text, row[1] == label
-                if current_reflection != row[0]:
-                    # create a new entry in the dictionary if one doesn't exist for the current reflection
-                    if current_reflection not in data.keys():
-                        data.update({current_reflection: [reflection_labels]})  # new reflection_labels array
-                        # refs_labelsets needed to calculate inter-annotator disagreement
-                        reflections.append(current_reflection)  # current_reflection replaced, add to reflections
-                    else:
-                        data[current_reflection].append(reflection_labels)
-                    i = 0
-                    reflection_labels = []
-                    current_reflection = row[0]
-                reflection_labels.append(row[1])
-                i += 1
-
-    refs_labelsets = {}
-
-    # resolve label lists to consensus label list for each reflection
-    for key in data.keys():
-        # https://stackoverflow.com/questions/1518522/find-the-most-common-element-in-a-list
-
-        for i in range(0, len(data[key])):
-            while 1+max(list(issue2integer.values())) in data[key][i]:
-                data[key][i].remove(1+max(list(issue2integer.values())))  # remove all integers mapping to an excluded label
-        data[key] = [list(set(l_set)) for l_set in data[key] if l_set]  # remove empty label sets after removing excluded labels
-
-        label_sets = []
-        for label_set in data[key]:
-            label_sets.append([integer2issue[label] for label in label_set])
-        refs_labelsets.update({key: label_sets})
-
-        # choose the top n labels from the list of labels, where n is the mean number of labels for that reflection
-        # 1 in the case of every label being excluded, just to avoid a divide by zero error (that reflection will not be used)
-        n = 1 if len(data[key]) == 0 else round(sum([len(l_set) for l_set in data[key]]) / len(data[key]))
-
-        # flatten 2d list of label sets
-        data[key] = [label for l_set in data[key] for label in l_set]
-
-        if data[key]:
-            c = Counter(data[key]).most_common(n)
-            data[key].clear()
-            for i in range(0, n):
-                if i >= len(c):
-                    break
-                data[key].append(c[i][0])
-            for j in range(0, len(data[key])):
-                data[key][j] = integer2issue[data[key][j]]
-        # if the reflection corresponding to data[key] contains only excluded reflections, mark it with a -1
-        else:
-            data[key] = [-1]
-
-    # array of zeroes of size num_labels*num_reflections
-    # (pycharm is requiring me to give the type hint that the dataset is an ndarray
-    # to allow me to index into it, no idea why.)
-    dataset = np.zeros((len(data), len(integer2issue)), dtype=np.int8)  # type: np.ndarray
-
-    # populate final dataset with the consensus labels
-    i = 0
-    for label_set in data.values():
-        # case where all the labels are in exclude_labels, do not include in final dataset
-        if label_set[0] == -1:
-            i += 1
-            continue
-        for val in label_set:
-            dataset[i][issue2integer[val.strip()]] = 1
-        i += 1
+    # the consensus labeling itself is done in batch by consensus.py: every annotation file is encoded
+    # into integer arrays (reflection id, label set id, label id) and the top n labels are chosen for
+    # every reflection at once
+    reflections, ref_ids, set_ids, label_ids, set_annotators = consensus.encode_annotations(files, schema)
+
+    # array of zeroes of size num_labels*num_reflections populated with the consensus labels
+    # reflections whose labels are all in exclude_labels are left as rows of zeroes
+    dataset = consensus.consensus_matrix(len(reflections), ref_ids, set_ids, label_ids, len(schema))
+    # label sets for each reflection (as annotator ids and label bitmasks), needed to calculate
+    # inter-annotator disagreement
+    annotators, masks = consensus.label_masks_by_reflection(len(reflections), ref_ids, set_ids, label_ids, set_annotators)
 
     # reflections_new is every reflection that has at least one label in dataset
-    reflections_new = []
-    for i in range(0, len(dataset)):
-        if dataset[i].any():
-            reflections_new.append(reflections[i])
-    # (https://stackoverflow.com/questions/11188364/remove-zero-lines-2-d-numpy-array)
-    dataset = dataset[~np.all(dataset == 0, axis=1)]  # nice one liner to remove all lists of zeroes from 2d ndarray
-    column_names = list(integer2issue.values())
+    has_labels = dataset.any(axis=1)
+    reflections_new = [ref for ref, keep in zip(reflections, has_labels) if keep]
+    dataset = dataset[has_labels]  # remove all rows of zeroes
+    column_names = schema.labels
 
     # https://stackoverflow.com/questions/20763012/creating-a-pandas-dataframe-from-a-numpy-array-how-do-i-specify-the-index-colum
     df = pd.DataFrame(data=dataset, columns=column_names)
     # append column for reflection associated with each set of labels
-    df.insert(len(dataset[0]), "text", reflections_new)
+    df.insert(len(column_names), "text", reflections_new)
 
     df.to_csv(output_file, index=False)
 
-    # return new reflections for sanitize_gpt_reflections() and the the label sets
-    # and their corresponding reflections
-    package = [reflections_new, [list(item) for item in refs_labelsets.items()]]
+    # return new reflections for sanitize_gpt_reflections(), the the label sets
+    # and their corresponding reflections, and the consensus label matrix itself
+    package = [reflections_new, [[ref, a, m] for ref, a, m in zip(reflections, annotators, masks)], dataset]
 
     return package
 
@@ -209,37 +90,28 @@ def process(files, output_file, dataset_name):
 # METHOD PARAMETERS:
 # reflections: reflections_new from process()
 def sanitize_gpt_reflections(reflections):
-    # full_refs is a list of every reflection with no label exclusions
-    # which will be populated by gpt_reflections.csv
-    full_refs = []
-    # copy full reflection data w/o sub-responses
-    # with no label exclusion from gpt_reflections.csv into full_refs
-    with open("gpt_reflections.csv", "r", encoding="utf-8") as gpt:
-        c_r = csv.reader(gpt)
-        for row in c_r:
-            ref = ""
-            # concatenate each part in full_refs
-            for i in range(0, len(row)):
-                if i == len(row)-1:
-                    ref += row[i]
-                else:
-                    ref += row[i] + ' '
-            full_refs.append(ref)
-    del full_refs[0]
-    # indices of rows to remove from dataframe of gpt_reflections
-    # each row referenced in remove is one in full_refs
-    remove = []
-    # locate rows which are in full_refs but not in the label-truncated
-    # reflections parameter, read their indices into remove
-    for ref in full_refs:
-        if ref not in reflections:
-            remove.append(full_refs.index(ref))
     # dataframe of original gpt_reflections, each row contains the 5 sub-responses making
-    # up the entire reflections
-    df = pd.read_csv("gpt_reflections.csv")
+    # up the entire reflections. Read once, and keep every cell as the raw string (no "None" -> NaN
+    # conversion) so that the rebuilt reflections match the ones organize.py joined together.
+    # The first row is the question header, which is not written back out
+    df = pd.read_csv("gpt_reflections.csv", dtype=str, keep_default_na=False)
+    # full_refs is every reflection with no label exclusions, rebuilt by concatenating its sub-responses
+    full_refs = df.iloc[:, 0].str.cat([df.iloc[:, i] for i in range(1, len(df.columns))], sep=" ")
+
+    # index every reflection by its text so that looking up the desired reflections is a hash lookup
+    # instead of a list scan. Identical reflection texts can show up on several rows; every row with the
+    # same text is treated the same (all of them are kept or all of them are removed) instead of only
+    # acting on the first one
+    positions = full_refs.groupby(full_refs, sort=False).indices
+    desired = set(reflections)
+    duplicates = sum(1 for rows in positions.values() if len(rows) > 1)
+    if duplicates:
+        print(f"{duplicates} reflections appear on more than one row of gpt_reflections.csv")
+
+    # rows which are in full_refs but not in the label-truncated reflections parameter
+    remove = [row for ref, rows in positions.items() if ref not in desired for row in rows]
     # drop undesired rows simultaneously and overwrite gpt_reflections.csv with new truncated data
-    if remove:
-        df.drop(remove, inplace=True)
+    df = df.drop(df.index[sorted(remove)])
     df.to_csv("gpt_reflections.csv", index=False, header=False)
 
     # Note: I can't just return a csv of reflections_sanitized because I want gpt_reflections.csv
@@ -250,42 +122,34 @@ def sanitize_gpt_reflections(reflections):
 
 # Test method to make sure that full_dataset.csv and label_sets.csv contain the same reflections and labels
 def validate_datasets():
-    full = []
-    label_sets = []
-    with open("full_dataset.csv", "r", encoding="utf-8") as full:
-        c_r = csv.reader(full)
-        full = list(c_r)
-    with open("label_sets.csv", "r", encoding="utf-8") as l_sets:
-        c_r = csv.reader(l_sets)
-        label_sets = list(c_r)
+    labels, full, texts = dataset_artifact.read_dataset("full_dataset.csv")
+    label_sets = label_set_encoding.read_label_sets("label_sets.csv")
 
-    assert len(full)-1 == len(label_sets), "full_dataset.csv and label_sets.csv different lengths!"
+    assert len(texts) == len(label_sets), "full_dataset.csv and label_sets.csv different lengths!"
+    assert labels == label_sets.labels, "full_dataset.csv and label_sets.csv have different labels!"
 
-    for i in range(1, len(full)):
-        assert full[i][-1] == label_sets[i-1][0], f"Mismatched reflection found at index {i}!"
+    for i in range(0, len(texts)):
+        assert texts[i] == label_sets.texts[i], f"Mismatched reflection found at index {i+1}!"
 
     # check if the consensus labels were calculated correctly
-    for i in range(0, len(label_sets)):
-        # recalculate consensus labels for each reflection -- reminder: take the avg_len most common
-        # labels from each list of labels, where avg_len is the average length of the label set
-        # (e.g. if annotator one put 3 labels and annotator two put 1 label, the avg_len would be
-        # (3+1)/2 rounded which is 2
-
-        label_strs = eval(label_sets[i][1])
-        # only include a label if it's not in exclude_labels, and by extension in issue2integer.keys()
-        for j in range(0, len(label_strs)):
-            label_strs[j] = [label for label in label_strs[j] if label in list(issue2integer.keys())]
-
-        avg_len = 0
-        for l_set in label_strs:
-            avg_len += len(l_set)
-        avg_len = round(avg_len / len(label_strs))
-        # beefy list comprehension below flattens the 2d list of label sets into one list of labels
-        label_strs = [label for label_list in label_strs for label in label_list]
-        counter = Counter(label_strs).most_common(avg_len)
-        consensus_labels_encoded = [issue2integer[counter[i][0]] for i in range(0, len(counter))]
-        for label_enc in consensus_labels_encoded:
-            assert full[i+1][label_enc] == "1", f"Consensus label mismatch at reflection number {i}, reflection {full[i+1][-1]}!"
+    # recalculate consensus labels for each reflection -- reminder: take the avg_len most common
+    # labels from each list of labels, where avg_len is the average length of the label set
+    # (e.g. if annotator one put 3 labels and annotator two put 1 label, the avg_len would be
+    # (3+1)/2 rounded which is 2
+    avg_len = np.round(label_sets.mean_set_sizes()).astype(np.int64)
+    # counts[i][j] is how many annotators gave reflection i label j
+    counts = np.zeros((len(texts), len(labels)), dtype=np.int64)
+    np.add.at(counts, np.repeat(np.arange(len(texts)), label_sets.num_sets()), label_sets.bit_matrix())
+
+    chosen = np.asarray(full) == 1
+    # every reflection has avg_len consensus labels (or fewer, if fewer distinct labels were given)...
+    expected_len = np.minimum(avg_len, (counts > 0).sum(axis=1))
+    # ...and, since ties can go either way, no label that was left out was given more often than one that was chosen
+    min_chosen = np.where(chosen, counts, np.iinfo(np.int64).max).min(axis=1)
+    max_unchosen = np.where(chosen, -1, counts).max(axis=1)
+    bad = np.flatnonzero((chosen.sum(axis=1) != expected_len) | (min_chosen < max_unchosen) | (min_chosen == 0))
+    if len(bad) > 0:
+        raise AssertionError(f"Consensus label mismatch at reflection number {bad[0]}, reflection {texts[bad[0]]}!")
 
 
 def main():
@@ -297,96 +161,116 @@ def main():
     # Refer to the top of this file for instructions on minor manual dataset cleaning to be done first
     # This code will output a multi-label dataset for each sub-dataset (each D-ESX-X dataset) as well as
     # "gpt_reflections.csv", which is used in my GPT-4o implementation as part of the prompt
+    # Annotation sets whose annotations and label config haven't changed since the last run are loaded
+    # from build_cache/ instead of being processed again (see build_cache.py), delete it to rebuild everything
     
     # Superset of labels as of 1/28: 
     # [None, Python and Coding, GitHub, MySQL, Assignments, Quizzes, Learning New Material, Understanding requirements and instructions,
     # Course Structure and Materials, Time Management, Group Work, IDE and Package Installation, Personal Issue, API, HTML, SDLC, Other Primary]
-    # All labels in the data but not in the superset are excluded
+    # All labels in the data but not in the superset are excluded (the superset itself is SUPERSET in Shared/label_schema.py)
     #
     # Choose which labels to exclude in the final generated multilabel training dataset
     exclude_labels = ["Assignments", "Quizzes", "Learning New Material", "Understanding requirements and instructions", "Personal Issue"]
     # TODO write in support for secondary labels
     label_category = "Primary"  # CAUTION: as of 1/14 I have not written in full support for the secondary label category -- COMING SOON
+    # number of processes to parse the raw data and process the annotation sets with, None uses every CPU
+    # and 1 does everything in this process. The outputs are the same either way
+    workers = None
 
-    if exclude_labels:
-        # remove unwanted labels
-        for label in exclude_labels:
-            val = issue2integer.pop(label)
-            # only pop every val once
-            try:
-                integer2issue.pop(val)
-            except KeyError:
-                pass
-        # change integer values to be consecutive
-        i = 0
-        in_2_is_changes = []
-        for key in issue2integer.keys():
-            # special case: a lot of people put "FastAPI" instead of "API" as their label
-            # for issues with fastapi so "FastAPI" and "API" both map to the same integer
-            # but map back to just "API"
-            if key == "FastAPI":
-                issue2integer.update({key: i-1})
-            else:
-                issue2integer.update({key: i})
-                in_2_is_changes.append({i: key})
-                i += 1
-        integer2issue.clear()
-        for change in in_2_is_changes:
-            integer2issue.update(change)
-
-    next_available_num = max(list(issue2integer.values())) + 1
-    if label_category == "Primary":
-        issue2integer.update({"Other Primary": next_available_num})
-        integer2issue.update({next_available_num: "Other Primary"})
-    else:
-        issue2integer.update({"Other Secondary": next_available_num})
-        integer2issue.update({next_available_num: "Other Secondary"})
+    # the label columns and every accepted spelling of each label (see Shared/label_schema.py)
+    schema = label_schema.LabelSchema(exclude_labels=exclude_labels, label_category=label_category)
 
     if not os.path.isdir("data"):
         os.makedirs("data")
-    if len(os.listdir("data")) == 0:
-        organize.organize(label_category=label_category)  # wrangle the raw datasets into a format that can be further processed
-        # into a multi-label training dataset
+    # wrangle the raw datasets into a format that can be further processed into a multi-label training dataset
+    # organize() caches every parsed workbook by its content hash, so only workbooks that changed since
+    # the last run are actually re-parsed
+    # without raw_data/ (it isn't part of the repository), the annotation sets already in data/ are used as is
+    if organize.workbook_paths():
+        organize.organize(label_category=label_category, workers=workers)
+    elif not os.listdir("data"):
+        raise FileNotFoundError("No annotation sets in data/ and no workbooks in raw_data/ to generate them from!")
+    else:
+        print("No workbooks in raw_data/, using the annotation sets already in data/")
 
-    full_dataset = []
+    full_dataset = []  # consensus label matrix of each D-ESX-X dataset
     label_sets = []
+    config = schema.config()
     # for each sub directory in data (one for each annotation set), generate a multi-label training dataset
-    reflections_sanitized = []  # every reflection used, given label exclusion constraint
-    for sub_dir in os.listdir("data"):
+    # every distinct reflection is stored once, the reflections used are kept track of by id
+    store = reflection_store.ReflectionStore()
+    sanitized_ids = []  # ids of every reflection used, given label exclusion constraint
+    sanitized = set()  # the same ids, for membership tests
+    sub_dirs = os.listdir("data")
+    packages = {}
+    stale = []  # (sub_dir, files, output_file, inputs) of every annotation set that has to be processed
+    for sub_dir in sub_dirs:
         path = "data/" + sub_dir
-        files = Path(path).glob("*")  # glob() mentioned
+        # sorted so that a set gives the same results whether it is processed fresh or loaded from the cache
+        files = sorted(Path(path).glob("*"))
         output_file = "consensus-" + sub_dir + ".csv"
+        inputs = build_cache.set_digest(files)
 
-        # process() generates multi-label training dataset for each ESU/P dataset
-        # and then returns list of reflections for that dataset
-        package = process(files=files, output_file=output_file, dataset_name=sub_dir)
-
-        # package is the [0] the list of reflections to undergo further preprocessing for GPT code
-        # and [1] the label sets and their corresponding reflections for calculating Krippendorff's alpha
-        reflections_sanitized.extend([ref for ref in package[0]])
-
-        for ref_label_pair in package[1]:
-            if ref_label_pair[0] in reflections_sanitized:
+        package = build_cache.load_package(sub_dir, inputs, config) if os.path.exists(output_file) else None
+        if package is not None:
+            print(f"{sub_dir} unchanged since last run, using build_cache/{sub_dir}\n")
+            packages[sub_dir] = package
+        else:
+            stale.append((sub_dir, files, output_file, inputs))
+
+    # process() generates multi-label training dataset for each ESU/P dataset
+    # and then returns list of reflections for that dataset. Every annotation set is independent of the
+    # others, so with more than one to process they are spread over a process pool
+    if workers == 1 or len(stale) <= 1:
+        results = [process(files=files, output_file=output_file, dataset_name=sub_dir, schema=schema)
+                   for sub_dir, files, output_file, _ in stale]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(process, [s[1] for s in stale], [s[2] for s in stale],
+                                    [s[0] for s in stale], [schema] * len(stale)))
+    for (sub_dir, _, _, inputs), package in zip(stale, results):
+        build_cache.save_package(sub_dir, package, inputs, config)
+        packages[sub_dir] = package
+
+    # the packages are merged in the same order as the serial loop always did (os.listdir order),
+    # no matter which worker finished first
+    for sub_dir in sub_dirs:
+        package = packages[sub_dir]
+
+        # package is the [0] the list of reflections to undergo further preprocessing for GPT code,
+        # [1] the reflections with their annotator ids and label masks for calculating Krippendorff's alpha
+        # and [2] the consensus label matrix for the reflections in [0]
+        ids = store.intern_all(package[0])
+        sanitized_ids.append(ids)
+        sanitized.update(ids.tolist())
+
+        # lookup() gives -1 for reflections that were never used, which are never in sanitized
+        for ref_label_pair, ref_id in zip(package[1], store.lookup(pair[0] for pair in package[1]).tolist()):
+            if ref_id in sanitized:
                 label_sets.append(ref_label_pair)
 
-        # concatenate the datasets for each D-ESX-X dataset into one csv file full_dataset.csv
-        with open(output_file, 'r', encoding="utf-8") as of:
-            c_r = csv.reader(of)
-            for row in list(c_r)[1:]:  # don't include the header
-                full_dataset.append(row)
+        # the datasets for each D-ESX-X dataset are concatenated into full_dataset.csv (below)
+        full_dataset.append(package[2])
+    build_cache.prune(sub_dirs)
+    # every reflection used, in order (the same string objects as in the store, not copies)
+    reflections_sanitized = store.get(np.concatenate(sanitized_ids)) if sanitized_ids else []
 
     # Consensus datasets (D-ESP-4-1, D-ESP4-2, ...) concatenated into one csv
+    full_dataset = np.concatenate(full_dataset) if full_dataset else np.zeros((0, len(schema)), dtype=np.int8)
     with open("full_dataset.csv", 'w', encoding="utf-8", newline="") as fd:
         c_w = csv.writer(fd)
-        header = list(integer2issue.values())
+        header = list(schema.labels)
         header.append("text")
         c_w.writerow(header)
-        c_w.writerows(full_dataset)
+        c_w.writerows(row + [ref] for row, ref in zip(full_dataset.tolist(), reflections_sanitized))
+
+    # ...and into a memory-mappable binary copy of full_dataset.csv (full_dataset/), which the Filtering,
+    # SetFit and FastFit scripts can load without parsing the label matrix out of csv text again
+    dataset_artifact.write_artifact(dataset_artifact.artifact_path("full_dataset.csv"), full_dataset,
+                                    reflections_sanitized, schema.labels)
 
-    # Label sets for each dataset concatenated into one csv
-    with open("label_sets.csv", "w", encoding="utf-8", newline="") as l_s:
-        c_w = csv.writer(l_s)
-        c_w.writerows(label_sets)
+    # Label sets for each dataset concatenated into one csv (see Shared/label_set_encoding.py for the format)
+    label_set_encoding.write_label_sets("label_sets.csv", label_sets, schema.labels)
 
     # gpt_reflections is every reflection in raw_data divided in it's requisite sub-parts by default
     # based on reflections_sanitized which has been molded in accordance with the label exclusions,
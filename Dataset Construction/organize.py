@@ -1,24 +1,18 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import takewhile
 from pathlib import Path
 from pandas import DataFrame
 import pandas as pd
 import openpyxl
+import hashlib
+import json
 import os
+import shutil
 
-label_name_conversion = {
-    "python_and_coding": "Python and Coding",
-    "SDLC": "SDLC",
-    "github": "Github",
-    "mysql": "MySQL",
-    "api": "API",
-    "html": "HTML",
-    "ide_package_software_installation": "IDE and Package Installation",
-    "ide_and_environment_setup": "IDE and Package Installation",
-    "course_structure_and_materials": "Course Structure and Materials",
-    "understanding_requirements_and_instructions": "Understanding requirements and instructions",
-    "time_management_and_motivation": "Time Management and Motivation",
-    "group_work": "Group Work",
-    "none": "None"
-}
+import label_schema
+
+# parsed workbooks are cached here, keyed by a hash of the workbook's contents (see parse_workbooks())
+CACHE_DIR = "raw_data_cache"
 
 # this script converts raw, (minimally) unprocessed datasets from excel files
 # to intermediate .csvs that will be used in main.py to create multi-label training datasets
@@ -30,65 +24,152 @@ label_name_conversion = {
 # on one row in the google sheet conflicts with the code in organize() (and other code in main.py),
 # because I wrote that code specifically to handle the old annotation formatting.
 # So now we need this method that painstakingly converts the new formatting back to the old formatting
-# Takes in an openpyxl worksheet with the new formatting and returns a dataframe with the old formatting
-def handle_esa41_formatting(sheet):
-    annotation_set = []
-    for row in sheet.values:
-        if not row[0]:  # skip the junk rows which contain the empty dropdowns
-            break
-        if "Primary_Label(s)" in row[-1]:
+# Takes in the rows of an openpyxl worksheet with the new formatting and returns a dataframe with the old formatting
+# raw_label_names maps the dropdown label names to label names (label_schema.raw_label_names())
+def handle_esa41_formatting(rows, raw_label_names):
+    # stop at the junk rows which contain the empty dropdowns
+    frame = DataFrame(list(takewhile(lambda row: row[0], rows)))
+    if frame.empty:
+        return frame
+    label_col = frame.columns[-1]
+    frame = frame[~frame[label_col].str.contains("Primary_Label(s)", regex=False)]  # skip the header row(s)
+    # the values in the cells which contain the labels are represented as strings, regardless
+    # of whether the cell contains one or multiple labels. e.g. the cell with the labels GitHub, Python and Coding
+    # just becomes the string "GitHub, Python and Coding", not a list of strings (which is stupid)
+    # so split every label cell on its commas and give each label its own row (with the same reflection text)
+    labels = frame[label_col].str.split(",").explode().str.strip()
+    converted = labels.map(raw_label_names)
+    if converted.isna().any():
+        raise KeyError(labels[converted.isna()].iloc[0])
+    frame = frame.loc[labels.index].copy()
+    frame[label_col] = converted.to_numpy()
+    return frame.reset_index(drop=True)
+
+
+# Stream the rows of a worksheet in the old formatting, keeping only the five reflection columns and the
+# "Issue" column (the "Emotion" column and every column past "Issue" are dropped as each row is read)
+# Rows containing null values are skipped (all of the junk rows after the end of the dataset that are
+# still read in for some reason). Returns a dataframe indexed by the row's position in the sheet
+def read_sheet(sheet):
+    index = []
+    rows = []
+    for i, row in enumerate(sheet.iter_rows(values_only=True)):
+        if len(row) < 7:
+            row = tuple(row) + (None,) * (7 - len(row))
+        row = row[:5] + row[6:7]
+        if None in row:
             continue
-        # the values in the cells which contain the labels are represented as strings, regardless
-        # of whether the cell contains one or multiple labels. e.g. the cell with the labels GitHub, Python and Coding
-        # just becomes the string "GitHub, Python and Coding", not a list of strings (which is stupid)
-        # the only way to differentiate single label cells from multi label ones is to check for a comma in the string
-        labels = []  # goal: extract the labels from the string pseudo-list
-        # Leetcode sliding window problem in the wild
-        i = 0
-        j = 0
-        for char in row[-1]:
-            if char == ",":
-                labels.append(row[-1][i:j].strip())
-                i = j+1
-            j += 1
-        labels.append(row[-1][i:].strip())  # append final label that doesn't precede a comma
-        print(labels)
-        # for each label, create a new row
-        for label in labels:
-            entry = list(row[:-1])  # the reflection text
-            entry.append(label_name_conversion[label])
-            annotation_set.append(entry)
-    frame = DataFrame(annotation_set)
-    return frame
-
-
-def organize(label_category):
-    if label_category == "Primary":
-        label_name_conversion.update({"other": "Other Primary"})
+        index.append(i)
+        rows.append(row)
+    return DataFrame(rows, index=index, columns=[0, 1, 2, 3, 4, 6])
+
+
+# Parse every sheet of one workbook in raw_data (possibly in a worker process)
+# The workbook is opened in read-only mode so rows are streamed instead of loading the whole workbook,
+# returns a list of (sheet_name, DataFrame) pairs in sheet order
+def parse_workbook(path, label_category):
+    raw_label_names = label_schema.raw_label_names(label_category)
+    wb = openpyxl.load_workbook(path, read_only=True)
+    sheets = []
+    try:
+        for sheet_name in wb.sheetnames:
+            if sheet_name == "D-ESA4-1":  # special case: handle the new formatting in D-ESA4-1
+                df = handle_esa41_formatting(wb[sheet_name].iter_rows(values_only=True), raw_label_names)
+            else:  # standard case: handle the old formatting in every other dataset
+                df = read_sheet(wb[sheet_name])
+            sheets.append((sheet_name, df))
+    finally:
+        wb.close()
+    return sheets
+
+
+# sha256 of a workbook's contents, read in chunks so large workbooks aren't loaded into memory at once
+def workbook_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as wb:
+        for chunk in iter(lambda: wb.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Write the parsed sheets of a workbook to cache_dir, one parquet file per sheet plus sheets.json which
+# keeps the sheet names in order. Parquet needs string column names, so they're converted back and forth
+def save_cached_workbook(cache_dir, sheets):
+    os.makedirs(cache_dir, exist_ok=True)
+    for i, (sheet_name, df) in enumerate(sheets):
+        df.rename(columns=str).to_parquet(f"{cache_dir}/{i}.parquet")
+    # sheets.json is written last, so a cache entry without it is incomplete and is ignored
+    with open(f"{cache_dir}/sheets.json", "w", encoding="utf-8") as s:
+        json.dump([sheet_name for sheet_name, df in sheets], s)
+
+
+# Returns the cached list of (sheet_name, DataFrame) pairs for a workbook or None if it isn't cached
+def load_cached_workbook(cache_dir):
+    if not os.path.exists(f"{cache_dir}/sheets.json"):
+        return None
+    with open(f"{cache_dir}/sheets.json", "r", encoding="utf-8") as s:
+        sheet_names = json.load(s)
+    sheets = []
+    for i, sheet_name in enumerate(sheet_names):
+        df = pd.read_parquet(f"{cache_dir}/{i}.parquet")
+        sheets.append((sheet_name, df.rename(columns=int)))
+    return sheets
+
+
+# Parse every workbook in paths, only re-parsing workbooks whose contents changed since they were last
+# parsed. Each cache entry is keyed by the workbook's sha256 (and the label category, since that changes
+# how D-ESA4-1 labels are converted); entries for workbooks that no longer exist are removed
+# Returns one list of (sheet_name, DataFrame) pairs per path, in the same order as paths
+def parse_workbooks(paths, label_category, workers=None):
+    keys = [f"{workbook_digest(path)}-{label_category}" for path in paths]
+    parsed = [load_cached_workbook(f"{CACHE_DIR}/{key}") for key in keys]
+    stale = [i for i in range(0, len(paths)) if parsed[i] is None]
+    print(f"{len(paths) - len(stale)} of {len(paths)} workbooks unchanged, parsing {len(stale)}...\n")
+
+    if workers == 1 or len(stale) <= 1:
+        results = [parse_workbook(paths[i], label_category) for i in stale]
     else:
-        label_name_conversion.update({"other": "Other Secondary"})
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # map() returns the results in the same order as paths regardless of which worker finishes first
+            results = list(pool.map(parse_workbook, [paths[i] for i in stale], [label_category] * len(stale)))
+    for i, sheets in zip(stale, results):
+        parsed[i] = sheets
+        try:
+            save_cached_workbook(f"{CACHE_DIR}/{keys[i]}", sheets)
+        except Exception as e:  # e.g. a column with mixed types that parquet can't store, just don't cache it
+            print(f"Could not cache {paths[i]}: {e}")
+
+    if os.path.isdir(CACHE_DIR):
+        for entry in os.listdir(CACHE_DIR):
+            if entry not in keys:
+                shutil.rmtree(f"{CACHE_DIR}/{entry}", ignore_errors=True)
+
+    return parsed
+
 
+# Every workbook in raw_data (none without raw_data), sorted so the annotations are always numbered the same way
+def workbook_paths():
+    return [path for path in sorted(Path("raw_data").glob("*")) if path.is_file()]  # glob() mentioned
+
+
+# METHOD PARAMETERS
+# label_category: "Primary" or "Secondary"
+# workers: number of processes to parse the workbooks in raw_data with, defaults to the number of CPUs.
+#   workers=1 parses every workbook in this process
+def organize(label_category, workers=None):
+    paths = workbook_paths()
+    # without any workbooks there's nothing to regenerate data/ (or gpt_reflections.csv) from, so leave them be
+    if not paths:
+        print("No workbooks in raw_data/, nothing to organize")
+        return
     print("Sanitizing raw data...\n")
 
-    # glob all of the files in raw_data
-    paths = Path("raw_data").glob("*")  # glob() mentioned
     # annotations is of shape {dataset_name: [DataFrame]} where the
     # list of dataframes is the set of annotations for that dataset
     annotations = {}
-    for path in paths:
-        wb = openpyxl.load_workbook(path)
-        for sheet_name in wb.sheetnames:
-            wb.active = wb[sheet_name]  # move to next excel sheet
-            df = None  # non-pythonic but who cares
-            if sheet_name == "D-ESA4-1":  # special case: handle the new formatting in D-ESA4-1
-                df = handle_esa41_formatting(wb.active)
-            else:  # standard case: handle the old formatting in every other dataset
-                df = DataFrame(wb.active.values)
-                df.drop(5, axis="columns", inplace=True)  # drop "Emotion" column
-                df.drop([i for i in range(7, len(df.columns)+1)], axis="columns", inplace=True)  # drop every column past "Issue"
-                df.dropna(inplace=True)  # drop rows containing null values (all of the junk rows
-            # after the end of the dataset that are still read to the dataframe for some reason)
-
+    parsed = parse_workbooks(paths, label_category, workers=workers)
+    for sheets in parsed:
+        for sheet_name, df in sheets:
             if sheet_name not in annotations.keys():
                 annotations.update({sheet_name: [df]})
             else:
@@ -104,10 +185,9 @@ def organize(label_category):
         # write columns of reflection parts to separate list of dataframes
         ref_parts_dfs.append(DataFrame(annotations[ann][0].iloc[:, 0:5]))
         for df in annotations[ann]:
-            # TODO ***this code is slow and could probably be improved***
             new_df = DataFrame()
             # concatenate the first five columns, which make up the reflection text
-            new_df["text"] = df[[0, 1, 2, 3, 4]].agg(' '.join, axis=1)
+            new_df["text"] = df[0].str.cat([df[1], df[2], df[3], df[4]], sep=" ")
             # issue column
             new_df["label"] = df.iloc[:, 5]
             new_df_list.append(new_df)
@@ -123,6 +203,10 @@ def organize(label_category):
 
     # write processed annotations to csvs organized in file structure:
     # data --> [annotation sets] --> [annotations]
+    # data is regenerated from scratch every time, so clear out the old annotation sets first
+    for old_set in os.listdir("data"):
+        if os.path.isdir("data/" + old_set):
+            shutil.rmtree("data/" + old_set)
     for ann_set in annotations.keys():
         try:
             directory = "data/" + ann_set
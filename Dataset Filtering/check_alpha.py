@@ -0,0 +1,87 @@
+# Check the numpy versions of the agreement statistics in main.py and krippendorff_alpha.py against the
+# straightforward versions they replaced:
+#   krippendorff_alpha.alpha()           vs nltk's AnnotationTask.alpha(), with binary_distance and masi_alpha_distance
+#   masi_agreement()                     vs masi_distance() averaged over combinations() of every reflection's label sets
+#   krippendorff_alpha.threshold_sweep() vs nltk's alpha of the reflections kept at every threshold
+# on the fixture in fixtures/label_sets.csv (or any label_sets.csv given as an argument). binary_distance has to
+# match nltk exactly, MASI up to floating point rounding
+#
+# Run: python check_alpha.py [label_sets.csv]
+
+import math
+import sys
+from itertools import combinations
+from pathlib import Path
+
+import numpy as np
+from nltk.metrics import binary_distance
+from nltk.metrics.agreement import AnnotationTask
+
+# main.py also puts Shared/ on the path
+from main import masi_distance, masi_agreement, masi_alpha_distance, nltk_annotation_formatting, single_label_filter
+import krippendorff_alpha
+import label_set_encoding
+
+FIXTURE = Path(__file__).resolve().parent / "fixtures" / "label_sets.csv"
+TOLERANCE = 1e-12  # for MASI, binary_distance has to be exact
+
+
+def nltk_alpha(dataset, distance):
+    return AnnotationTask(data=nltk_annotation_formatting(dataset), distance=distance).alpha()
+
+
+def same(a, b, exact):
+    if math.isnan(a) or math.isnan(b):
+        return math.isnan(a) and math.isnan(b)
+    return a == b if exact else abs(a - b) <= TOLERANCE
+
+
+def check_alpha(name, dataset):
+    for distance, exact in [(binary_distance, True), (masi_alpha_distance, False)]:
+        alpha = krippendorff_alpha.alpha(dataset, distance)
+        expected = nltk_alpha(dataset, distance)
+        assert same(alpha, expected, exact), f"{name}, {distance.__name__}: alpha {alpha}, nltk {expected}"
+        print(f"{name}, {distance.__name__}: alpha {alpha} matches nltk ({expected})")
+
+
+def check_masi_agreement(dataset):
+    agreement = masi_agreement(dataset)
+    for i in range(0, len(dataset)):
+        label_sets = [frozenset(l_set) for l_set in dataset.label_sets(i)]
+        if len(label_sets) < 2:
+            assert math.isnan(agreement[i]), f"Reflection {i} has less than two label sets but agreement {agreement[i]}"
+            continue
+        dist = 0
+        pairs = list(combinations(label_sets, 2))
+        for label1, label2 in pairs:
+            dist += masi_distance(label1, label2)
+        assert agreement[i] == dist / len(pairs), f"Reflection {i}: agreement {agreement[i]}, loop {dist / len(pairs)}"
+    print(f"masi_agreement() matches the per-reflection loop on all {len(dataset)} reflections")
+    return agreement
+
+
+def check_sweep(dataset, agreement):
+    distances, counts, _ = krippendorff_alpha.coincidence_counts(dataset, binary_distance)
+    thresholds, sizes, alphas = krippendorff_alpha.threshold_sweep(distances, counts, agreement)
+    agreement = np.asarray(agreement)
+    for threshold, size, alpha in zip(thresholds, sizes, alphas):
+        kept = dataset.subset(np.flatnonzero(agreement >= threshold))
+        assert size == len(kept), f"Threshold {threshold}: sweep keeps {size} reflections, filtering keeps {len(kept)}"
+        expected = nltk_alpha(kept, binary_distance) if kept.num_sets().sum() else float("nan")
+        assert same(alpha, expected, False), f"Threshold {threshold}: sweep alpha {alpha}, nltk {expected}"
+    print(f"threshold_sweep() matches nltk at all {len(thresholds)} thresholds")
+
+
+def main():
+    dataset = label_set_encoding.read_label_sets(sys.argv[1] if len(sys.argv) > 1 else FIXTURE)
+    print(f"{len(dataset)} reflections, {int(dataset.num_sets().sum())} label sets")
+
+    check_alpha("all reflections", dataset)
+    check_alpha("single label reflections", single_label_filter(dataset))
+    agreement = check_masi_agreement(dataset)
+    check_sweep(dataset, agreement)
+    print("All checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# Krippendorff's alpha over the label sets of a LabelSets (see Shared/label_set_encoding.py), the same
+# statistic nltk's AnnotationTask.alpha() calculates, without nltk's pure Python loops over every
+# (item, coder) pair
+#
+# Every distinct label set (label mask) that shows up is a "value". The distance between every pair of
+# values is calculated once, into a (values x values) matrix, and every reflection is a row of counts of
+# how many annotators gave it each value. The observed disagreement of reflection i is then
+#   counts[i] @ distances @ counts[i] / (n_i * (n_i - 1))
+# (the pairable values within reflection i, i.e. its row of the coincidence matrix), and the expected
+# disagreement is the same thing for the total counts over every reflection
+#
+# With an integer valued distance like binary_distance every count of pairs is an exact integer and the
+# result is identical to nltk's, with other distances (e.g. MASI) it can differ in the last few digits
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+# METHOD PARAMETERS
+# dataset: LabelSets with the label sets of every reflection (every label set is one annotator's "coding")
+# distance: distance function between two label sets as frozensets of label names, e.g. nltk's
+#   binary_distance, distance(l, l) has to be 0
+# RETURNS the (values x values) distance matrix, the (reflections x values) count matrix and the masks of the values
+def coincidence_counts(dataset, distance):
+    values, inverse = np.unique(dataset.masks, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    sets = [frozenset(dataset.decode(mask)) for mask in values.tolist()]
+    distances = np.array([[distance(a, b) for b in sets] for a in sets], dtype=float)
+    if np.array_equal(distances, np.round(distances)):
+        distances = distances.astype(np.int64)  # exact integer arithmetic from here on
+
+    owners = np.repeat(np.arange(len(dataset)), dataset.num_sets())
+    counts = np.zeros((len(dataset), len(values)), dtype=np.int64)
+    np.add.at(counts, (owners, inverse), 1)
+    return distances, counts, values
+
+
+# Sum over every pair of values in each row of counts of count_a * count_b * distance(a, b)
+def pair_disagreements(counts, distances):
+    return np.einsum("ik,kl,il->i", counts, distances, counts)
+
+
+# Krippendorff's alpha from a distance matrix and a count matrix (see coincidence_counts()), with the same
+# degenerate cases as nltk: alpha is 1 when every annotator gave the same value, and reflections with fewer
+# than two label sets are ignored
+def alpha_from_counts(distances, counts):
+    if counts.shape[1] == 0:
+        raise ValueError("Cannot calculate alpha, no data present!")
+    if counts.shape[1] == 1:
+        return 1
+
+    ratings = counts.sum(axis=1)
+    valid = ratings >= 2
+    if not valid.any():
+        raise ValueError("Cannot calculate alpha, no reflection has more than one label set!")
+    counts, ratings = counts[valid], ratings[valid]
+    totals = counts.sum(axis=0)
+    if np.count_nonzero(totals) == 1:
+        return 1
+
+    # per reflection disagreement times its number of ratings, added up in reflection order like nltk does
+    disagreements = (pair_disagreements(counts, distances) / (ratings * (ratings - 1)).astype(float)) * ratings
+    do = np.cumsum(disagreements)[-1] / totals.sum()
+    total = totals.sum()
+    de = float(totals @ distances @ totals) / (total * (total - 1))
+    return float(1.0 - do / de)
+
+
+# Krippendorff's alpha of the label sets in dataset under distance (see coincidence_counts())
+def alpha(dataset, distance):
+    distances, counts, _ = coincidence_counts(dataset, distance)
+    return alpha_from_counts(distances, counts)
+
+
+# Krippendorff's alpha of the reflections that would be kept at every agreement threshold, in one pass
+# Reflections are grouped by their agreement (sorted once, by np.unique), and going from the highest
+# agreement down each group's counts and disagreement are added to running totals, which is the same as
+# dropping groups one at a time going the other way. Reflections with a nan agreement are never kept
+# METHOD PARAMETERS
+# distances, counts: see coincidence_counts()
+# agreement: agreement of every row of counts, a reflection is kept at threshold t if agreement >= t
+# RETURNS every distinct agreement value (ascending) and, for each of them as the threshold, the number of
+# reflections kept and their alpha (nan if there's nothing to calculate alpha on)
+def threshold_sweep(distances, counts, agreement):
+    agreement = np.asarray(agreement, dtype=float)
+    keep = ~np.isnan(agreement)
+    counts, agreement = counts[keep], agreement[keep]
+    thresholds, group = np.unique(agreement, return_inverse=True)
+    group = group.reshape(-1)
+
+    ratings = counts.sum(axis=1)
+    valid = ratings >= 2
+    disagreements = np.zeros(len(counts))
+    disagreements[valid] = (pair_disagreements(counts[valid], distances) /
+                            (ratings[valid] * (ratings[valid] - 1)).astype(float)) * ratings[valid]
+
+    # per group sums, then running sums from the highest threshold down
+    group_totals = np.zeros((len(thresholds), counts.shape[1]), dtype=np.int64)
+    np.add.at(group_totals, group[valid], counts[valid])
+    totals = np.cumsum(group_totals[::-1], axis=0)[::-1]
+    do_sums = np.cumsum(np.bincount(group, weights=disagreements, minlength=len(thresholds))[::-1])[::-1]
+    sizes = np.cumsum(np.bincount(group, minlength=len(thresholds))[::-1])[::-1]
+
+    total = totals.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        do = do_sums / total
+        de = pair_disagreements(totals, distances) / (total * (total - 1)).astype(float)
+        alphas = 1.0 - do / de
+    values = np.count_nonzero(totals, axis=1)
+    alphas[values == 1] = 1  # every annotator gave the same label set
+    alphas[values == 0] = np.nan
+    return thresholds.tolist(), sizes.tolist(), alphas.tolist()
+
+
+# Per reflection pieces of alpha_from_counts(), for the reflections alpha is calculated on (at least two label
+# sets): their value counts and their disagreement times their number of ratings. alpha of any multiset of these
+# reflections is 1 - (sum of disagreements / sum of ratings) / (expected disagreement of the summed counts)
+def item_contributions(distances, counts):
+    ratings = counts.sum(axis=1)
+    counts, ratings = counts[ratings >= 2], ratings[ratings >= 2]
+    disagreements = (pair_disagreements(counts, distances) / (ratings * (ratings - 1)).astype(float)) * ratings
+    return counts, disagreements
+
+
+# alpha of every row of weights, where weights[b][i] is how many times reflection i is in resample b
+def weighted_alphas(distances, counts, disagreements, weights):
+    totals = weights @ counts
+    total = totals.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        do = (weights @ disagreements) / total
+        de = pair_disagreements(totals, distances) / (total * (total - 1)).astype(float)
+        alphas = 1.0 - do / de
+    alphas[np.count_nonzero(totals, axis=1) == 1] = 1
+    return alphas
+
+
+# the arrays every bootstrap worker needs, sent once per worker process instead of once per chunk
+_bootstrap_data = None
+
+
+def _init_bootstrap(distances, counts, disagreements):
+    global _bootstrap_data
+    _bootstrap_data = (distances, counts, disagreements)
+
+
+def _bootstrap_chunk(seed, resamples):
+    distances, counts, disagreements = _bootstrap_data
+    rng = np.random.default_rng(seed)
+    weights = rng.multinomial(len(counts), np.full(len(counts), 1 / len(counts)), size=resamples)
+    return weighted_alphas(distances, counts, disagreements, weights)
+
+
+# Bootstrap distribution of alpha: the reflections (with at least two label sets) are resampled with replacement
+# resamples times and alpha is calculated for every resample. Every resample is just a vector of how many times
+# each reflection was drawn, so a chunk of resamples is a couple of matrix products over item_contributions().
+# Chunks of chunk_size resamples are spread over a process pool, each with its own seed spawned from seed, so the
+# result only depends on seed (not on the number of workers)
+# METHOD PARAMETERS
+# distances, counts: see coincidence_counts()
+# workers: number of processes, None uses every CPU and 1 runs everything in this process
+def bootstrap_alphas(distances, counts, resamples=2000, seed=0, workers=None, chunk_size=250):
+    counts, disagreements = item_contributions(distances, counts)
+    if len(counts) == 0:
+        raise ValueError("Cannot bootstrap alpha, no reflection has more than one label set!")
+
+    sizes = [min(chunk_size, resamples - start) for start in range(0, resamples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if workers == 1 or len(sizes) <= 1:
+        _init_bootstrap(distances, counts, disagreements)
+        results = [_bootstrap_chunk(s, size) for s, size in zip(seeds, sizes)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_bootstrap,
+                                 initargs=(distances, counts, disagreements)) as pool:
+            # map() returns the chunks in order regardless of which worker finishes first
+            results = list(pool.map(_bootstrap_chunk, seeds, sizes))
+    return np.concatenate(results)
+
+
+# (low, high) bounds of the confidence interval of alpha from bootstrap_alphas()
+def confidence_interval(alphas, confidence=0.95):
+    alphas = np.asarray(alphas)
+    alphas = alphas[~np.isnan(alphas)]
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(alphas, [tail, 100 - tail])
+    return float(low), float(high)
@@ -1,10 +1,22 @@
-import copy
 import csv
+import math
+import sys
 from itertools import combinations
+from pathlib import Path
 from nltk.metrics.agreement import AnnotationTask
 from nltk.metrics import binary_distance
 from matplotlib import pyplot as plt
-import pandas as pd
+import numpy as np
+
+# modules shared between every stage of the pipeline live in Shared/ at the top of the repository
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Shared"))
+import dataset_artifact
+import label_set_encoding
+import reflection_store
+import krippendorff_alpha
+
+# number of rows low_disagreement_dataset.csv is written in at a time
+WRITE_CHUNK = 4096
 
 
 # filters out reflections that, by consensus of number of labels, have only
@@ -15,24 +27,14 @@ import pandas as pd
 # three single labels that are all different) because low disagreement reflections (or those with
 # varying label sets) will get filtered out anyway
 def single_label_filter(dataset):
-    ret_dataset = []
+    # dataset is a LabelSets (see Shared/label_set_encoding.py) which contains every reflection and its
+    # corresponding label sets
+    avg_len = np.round(dataset.mean_set_sizes())
 
-    # dataset is a list of tuples which each contain a reflection and its corresponding label sets
-    # both items in the tuple are strings since dataset was read from a csv file
-    for row in dataset:
-        labels = eval(row[1])
-        avg_len = 0
-        for label_set in labels:
-            avg_len += len(label_set)
-        avg_len = round(avg_len / len(labels))
-
-        # Since label_sets.csv / dataset contains only the labels used to calculate the consensus labels,
-        # if the average length of the labels in dataset is 1, there is only one consensus label attached to
-        # that reflection in full_dataset.csv
-        if avg_len == 1:
-            ret_dataset.append(row)
-
-    return ret_dataset
+    # Since label_sets.csv / dataset contains only the labels used to calculate the consensus labels,
+    # if the average length of the labels in dataset is 1, there is only one consensus label attached to
+    # that reflection in full_dataset.csv
+    return dataset.subset(np.flatnonzero(avg_len == 1))
 
 
 # Fixed version of NLTK's masi_distance()
@@ -58,61 +60,138 @@ def masi_distance(label1, label2):
     return (len_intersection / float(len_union)) * m
 
 
+# masi_distance() averaged over every pair of label sets (annotators) of a reflection, for every reflection
+# in dataset at once. Each label set is a bitmask (see Shared/label_set_encoding.py), so the intersection,
+# union, subset and disjointness checks of masi_distance() are just bitwise operations on arrays of masks.
+# Reflections are grouped by their number of label sets so that every group is a (reflections x pairs) array
+# Returns a list with the agreement of every reflection, nan for reflections with less than two label sets
+def masi_agreement(dataset):
+    num_sets = dataset.num_sets()
+    agreement = np.full(len(dataset), np.nan)
+    for k in np.unique(num_sets[num_sets >= 2]).tolist():
+        refs = np.flatnonzero(num_sets == k)
+        masks = dataset.masks[dataset.offsets[refs][:, None] + np.arange(k)]  # (reflections x k)
+        # pairs in the same order combinations() gave them to the per-reflection loop
+        first, second = (list(p) for p in zip(*combinations(range(0, k), 2)))
+        label1, label2 = masks[:, first], masks[:, second]
+        both = label1 & label2
+        len_intersection = label_set_encoding.popcount(both)
+        len_union = label_set_encoding.popcount(label1 | label2)
+        m = np.select([label1 == label2, (both == label1) | (both == label2), len_intersection > 0],
+                      [1, 0.67, 0.33], 0)
+        dists = (len_intersection / np.maximum(len_union, 1).astype(float)) * m
+
+        # summed one pair at a time, in order, so the floating point results are exactly the ones the
+        # per-reflection loop got (the agreement values are used as dict keys below)
+        dist = np.zeros(len(refs))
+        for pair in range(0, dists.shape[1]):
+            dist += dists[:, pair]
+        agreement[refs] = dist / dists.shape[1]
+    return agreement.tolist()
+
+
 def nltk_annotation_formatting(dataset):
     ret_dataset = []
-    i = 0
-    coder_id = 0
-    for row in dataset:
-        for ann_set in eval(row[1]):
+    for i in range(0, len(dataset)):
+        for coder_id, ann_set in enumerate(dataset.label_sets(i)):
             annotator = "coder_" + str(coder_id)
             ret_dataset.append((annotator, i, frozenset(ann_set)))
-            coder_id += 1
-        i += 1
-        coder_id = 0
     return ret_dataset
 
 
+# masi_distance() is really the MASI agreement (1 for identical label sets), this is the distance
+# version of it for Krippendorff's alpha, which gives partially agreeing label sets partial credit
+def masi_alpha_distance(label1, label2):
+    return 1 - masi_distance(label1, label2)
+
+
 # This function calculates and prints the Krippendorff's alpha value for the
 # previous unfiltered dataset and the newly filtered dataset to validate that
 # filtering the dataset improved the inter-annotator agreement
-def validation(prev_dataset, new_dataset):
-    formatted_annts_new = nltk_annotation_formatting(new_dataset)
-    formatted_annts_prev = nltk_annotation_formatting(prev_dataset)
+# METHOD PARAMETERS
+# distance: binary_distance or masi_alpha_distance
+# check_nltk: also calculate both alphas with nltk's (much slower) AnnotationTask and make sure they match
+def validation(prev_dataset, new_dataset, distance=binary_distance, check_nltk=False):
+    # see krippendorff_alpha.py
+    alpha_prev = krippendorff_alpha.alpha(prev_dataset, distance)
+    alpha_new = krippendorff_alpha.alpha(new_dataset, distance)
+
+    if check_nltk:
+        for dataset, alpha in [(prev_dataset, alpha_prev), (new_dataset, alpha_new)]:
+            task = AnnotationTask(data=nltk_annotation_formatting(dataset), distance=distance)
+            assert abs(task.alpha() - alpha) < 1e-9, f"Alpha {alpha} doesn't match nltk's {task.alpha()}!"
+
+    return alpha_prev, alpha_new
 
-    task_prev = AnnotationTask(data=formatted_annts_prev, distance=binary_distance)
-    task_new = AnnotationTask(data=formatted_annts_new, distance=binary_distance)
 
-    return task_prev.alpha(), task_new.alpha()
+# 95% bootstrap confidence interval of the Krippendorff's alpha of dataset (see krippendorff_alpha.bootstrap_alphas())
+# resamples: how many times the reflections are resampled
+# workers: number of processes to spread the resamples over, None uses every CPU
+def bootstrap_interval(dataset, resamples, distance=binary_distance, workers=None):
+    distances, counts, _ = krippendorff_alpha.coincidence_counts(dataset, distance)
+    alphas = krippendorff_alpha.bootstrap_alphas(distances, counts, resamples=resamples, workers=workers)
+    return krippendorff_alpha.confidence_interval(alphas)
 
 
 # To avoid having to regenerate label_sets.csv every time I want to filter a D-ESX-X sub-dataset,
 # just start with the full label_sets.csv and filter out reflections in it that aren't in
-# full_dataset.csv
-def match_to_full_dataset(label_sets):
-    dataset_refs = pd.read_csv("full_dataset.csv")["text"].to_numpy().tolist()
-    all_refs = pd.DataFrame(label_sets)[0].to_numpy().tolist()
+# full_dataset.csv (dataset_refs is the text column of full_dataset.csv, all_refs the reflections of label_sets.csv)
+# Returns the position in label_sets.csv of every reflection in full_dataset.csv
+# Reflections with exactly the same text are matched by occurrence, i.e. the second copy of a reflection in
+# full_dataset.csv is matched to the second copy of it in label_sets.csv. Raises an AssertionError listing the
+# reflections of full_dataset.csv that label_sets.csv doesn't have (enough copies of)
+def match_to_full_dataset(all_refs, dataset_refs):
+    # every position of every reflection in label_sets.csv, in order, built in one pass
+    positions = {}
+    for idx, ref in enumerate(all_refs):
+        positions.setdefault(ref, []).append(idx)
 
-    # would just filter a dataframe but that encounters a tricky bug
-    # where reflections with exactly the same text are wrongly included
     ret_dataset = []
-    first_ref = dataset_refs[0]
-    # https://stackoverflow.com/questions/6294179/how-to-find-all-occurrences-of-an-element-in-a-list
-    i = 0
-    while len(ret_dataset) < len(dataset_refs):
-        idx = all_refs.index(first_ref)
-        while i < len(dataset_refs) and dataset_refs[i] == all_refs[idx]:
-            ret_dataset.append(label_sets[idx])
-            idx += 1
-            i += 1
-        if i < len(dataset_refs):
-            first_ref = dataset_refs[i]
-
-    assert len(dataset_refs) == len(ret_dataset), f"{len(dataset_refs)}, {len(ret_dataset)}"
-    assert dataset_refs == [row[0] for row in ret_dataset], "Datasets contain differing reflections"
+    used = {}  # how many copies of each reflection have been matched so far
+    missing = []  # (row in full_dataset.csv, reflection) of every reflection that couldn't be matched
+    for i, ref in enumerate(dataset_refs):
+        occurrence = used.get(ref, 0)
+        candidates = positions.get(ref, [])
+        if occurrence < len(candidates):
+            ret_dataset.append(candidates[occurrence])
+            used[ref] = occurrence + 1
+        else:
+            missing.append((i + 2, ref))  # +2 for the header row and 1-based row numbers
+
+    if missing:
+        examples = "\n".join(f"  row {row}: {ref[:80]!r}" for row, ref in missing[:10])
+        raise AssertionError(f"{len(missing)} of {len(dataset_refs)} reflections in full_dataset.csv are not in "
+                             f"label_sets.csv (or are in it fewer times), e.g.\n{examples}\n"
+                             f"Make sure both files were generated by the same Dataset Construction run")
 
     return ret_dataset
 
 
+# Sweep mode: instead of filtering with one threshold, find the dataset length and Krippendorff's alpha of the
+# filtered dataset for every threshold at once. Only the distinct agreement values matter as thresholds (any
+# threshold in between keeps the same reflections), and krippendorff_alpha.threshold_sweep() calculates all of
+# them in one pass over the reflections sorted by agreement. The curve is written to threshold_sweep.csv and plotted
+# METHOD PARAMETERS
+# dataset: LabelSets of the reflections that can be filtered (after single_label_filter() if single_label)
+# agreement: masi_agreement() of dataset
+def threshold_sweep(dataset, agreement, distance=binary_distance):
+    distances, counts, _ = krippendorff_alpha.coincidence_counts(dataset, distance)
+    thresholds, lengths, alphas = krippendorff_alpha.threshold_sweep(distances, counts, agreement)
+
+    with open("threshold_sweep.csv", "w", encoding="utf-8", newline="") as t_s:
+        c_w = csv.writer(t_s)
+        c_w.writerow(["threshold", "dataset_length", "alpha"])
+        c_w.writerows(zip(thresholds, lengths, alphas))
+    for threshold, length, alpha in zip(thresholds, lengths, alphas):
+        print(f"Threshold {threshold}: Krippendorff's alpha {alpha} with dataset length: {length}")
+    print("Sweep written to threshold_sweep.csv")
+
+    plt.plot(thresholds, alphas, marker="o")
+    plt.xlabel("Agreement Threshold")
+    plt.ylabel("Alpha")
+    plt.show()
+
+
 # Calculates the agreement for each reflection based on label_sets.csv (see below) and filter out reflections
 # from a provided dataset with
 def main():
@@ -125,48 +204,60 @@ def main():
     # and label_sets.csv for any labels you wish
     # Last, alter threshold to change the agreement threshold for inclusion
     # in the final dataset.
+    # To pick a threshold, set sweep to True first: the alpha and length of the filtered dataset for every
+    # possible threshold are written to threshold_sweep.csv (and plotted), and no dataset is written
+    # Set bootstrap_resamples to e.g. 2000 to also get 95% confidence intervals for both alphas in the validation
 
     threshold = 0.0
     single_label = True
+    sweep = False
+    bootstrap_resamples = 0
 
     # Users can ignore everything else below
     unfiltered_dataset = None
 
-    # dist_to_ref will map agreement values to lists of reflections, i.e. every reflection
+    # full_dataset.csv is read from its memory-mapped copy (full_dataset/) when Dataset Construction wrote one
+    label_names, full_matrix, full_refs = dataset_artifact.read_dataset("full_dataset.csv")
+    # every distinct reflection gets an id, which is what everything below works with instead of the text
+    store = reflection_store.ReflectionStore()
+    full_ids = store.intern_all(full_refs)
+
+    # dist_to_ref will map agreement values to lists of reflection ids, i.e. every reflection
     # with a 1.0 (perfect) agreement is placed into the 1.0 agreement list bucket in the dictionary
     dist_to_ref = {}
-    with open("label_sets.csv", "r", encoding="utf-8") as ls:
-        c_r = list(csv.reader(ls))
+    # every reflection's label sets, parsed once (see Shared/label_set_encoding.py)
+    label_sets = label_set_encoding.read_label_sets("label_sets.csv")
 
-        c_r = match_to_full_dataset(label_sets=c_r)
+    positions = match_to_full_dataset(all_refs=label_sets.texts, dataset_refs=full_refs)
 
-        unfiltered_dataset = copy.deepcopy(c_r)  # copy of the original dataset is saved for later validation
+    unfiltered_dataset = label_sets.subset(positions)  # the original dataset is saved for later validation
+    dataset = unfiltered_dataset
 
-        # filter out reflections that (based on the consensus length) don't have only one label
-        # this is useful and necessary for running experiments with FastFit
-        if single_label:
-            c_r = single_label_filter(c_r)
+    # filter out reflections that (based on the consensus length) don't have only one label
+    # this is useful and necessary for running experiments with FastFit
+    if single_label:
+        dataset = single_label_filter(dataset)
+    dataset_ids = store.lookup(dataset.texts).tolist()
 
-        for elem in c_r:  # elem is a tuple containing the reflection-labelset pair
-            labels = eval(elem[1])
+    # calculating reflection agreement by taking the averaged masi distance across
+    # all possible unique subsets of the labels for every reflection (all at once, see masi_agreement())
+    agreement = masi_agreement(dataset)
+    if sweep:
+        threshold_sweep(dataset, agreement)
+        return
 
-            # calculating reflection agreement by taking the averaged masi distance across
-            # all possible unique subsets of the labels for every reflection
-            dist = 0
-            all_combinations = list(combinations([i for i in range(0, len(labels))], 2))
-            if not all_combinations:
-                continue
-            for combin in all_combinations:
-                dist += masi_distance(set(labels[combin[0]]), set(labels[combin[1]]))
-            dist = dist / len(all_combinations)
+    for r in range(0, len(dataset)):
+        dist = agreement[r]
+        if math.isnan(dist):  # fewer than two label sets, nothing to agree on
+            continue
 
-            # print(f"{dist} for label set: {labels}")
+        # print(f"{dist} for label set: {dataset.label_sets(r)}")
 
-            # closed addressing collision handling is just easier to work with
-            if dist not in dist_to_ref.keys():
-                dist_to_ref.update({dist: [elem[0]]})
-            else:
-                dist_to_ref[dist].append(elem[0])
+        # closed addressing collision handling is just easier to work with
+        if dist not in dist_to_ref.keys():
+            dist_to_ref.update({dist: [dataset_ids[r]]})
+        else:
+            dist_to_ref[dist].append(dataset_ids[r])
 
     dists = list(dist_to_ref.keys())
     dists.sort()
@@ -174,47 +265,49 @@ def main():
     # filter out distances less than the threshold
     dists = [dist for dist in dists if dist >= threshold]
 
-    desired_reflections = []
+    desired_reflections = set()  # ids of the reflections to keep
     for d in dists:
-        desired_reflections.extend(dist_to_ref[d])
+        desired_reflections.update(dist_to_ref[d])
     print(f"\nAll existing agreement measurements meeting threshold {threshold}: {dists}")
     print("Writing all reflections meeting threshold to low_disagreement_dataset.csv...")
 
-    filtered_dataset = []
-
     # write the newly filtered dataset
+    # row i of full_dataset.csv and reflection i of unfiltered_dataset are the same reflection (see
+    # match_to_full_dataset()), so one selection of positions gives both the rows to write and the filtered label sets
+    kept = np.flatnonzero(np.isin(full_ids, np.fromiter(desired_reflections, dtype=np.int64)))
+    kept_refs = [full_refs[i] for i in kept.tolist()]
+    # rows of full_dataset.csv written to low_disagreement_dataset.csv, kept for its binary copy
+    kept_rows = np.zeros((len(kept), len(label_names)), dtype=np.int8)
     with open("low_disagreement_dataset.csv", "w", encoding="utf-8", newline="") as low_d:
         c_w = csv.writer(low_d)
-        with open("full_dataset.csv", "r", encoding="utf-8") as full_d:
-            c_r = list(csv.reader(full_d))
-            labels = [lb for lb in c_r[0][:-1]]  # every label column except "text" for single label dataset
-            print(f"Labels found: {labels}")
+        print(f"Labels found: {label_names}")  # every label column except "text" for single label dataset
+        c_w.writerow(["text", "label"] if single_label else label_names + ["text"])  # write header row
+        # written a chunk of rows at a time, so only those rows of full_matrix are ever read in at once
+        for start in range(0, len(kept), WRITE_CHUNK):
+            chunk = slice(start, start + WRITE_CHUNK)
+            rows = np.asarray(full_matrix[kept[chunk]])
+            refs = kept_refs[chunk]
             if single_label:
-                c_w.writerow(["text", "label"])  # write header row
-                for row in c_r[1:]:
-                    if row[-1] in desired_reflections:
-                        # search for the index of the "1" in the multi-label dataset and
-                        # find the corresponding label in the labels array using that index
-                        i = 0
-                        while row[i] == "0":
-                            i += 1
-                        # row[-1] is the reflection text and labels[i] is the label
-                        c_w.writerow([row[-1], labels[i]])
+                # the index of the 1 in each row of the multi-label dataset is the index of its label in label_names
+                label_ids = np.argmax(rows, axis=1)
+                c_w.writerows([ref, label_names[i]] for ref, i in zip(refs, label_ids.tolist()))
+                kept_rows[chunk][np.arange(len(rows)), label_ids] = 1
             else:
-                c_w.writerow(c_r[0])  # write header row
-                for row in c_r[1:]:
-                    if row[-1] in desired_reflections:
-                        c_w.writerow(row)
-
-            # filter label_sets.csv as well to run validation (below)
-            for row in unfiltered_dataset:
-                if row[0] in desired_reflections:
-                    filtered_dataset.append(row)  # filtered dataset is the same as low_disagreement_dataset.csv,
-                    # just formatted the same way as label_sets.csv and always multi-label
-                    # this is necessary because we need access to every set of labels from every annotator.
-                    # filtered_dataset is multi-label regardless of whether single_label is true because
-                    # it wouldn't make sense to compare the krippendorff of a single-label dataset to a multi-label one
-                    # and the starting dataset is always multi-label (and we are comparing against the starting dataset)
+                c_w.writerows(row + [ref] for row, ref in zip(rows.tolist(), refs))
+                kept_rows[chunk] = rows
+
+    # filter label_sets.csv as well to run validation (below)
+    filtered_dataset = unfiltered_dataset.subset(kept)
+    # filtered dataset is the same as low_disagreement_dataset.csv,
+    # just formatted the same way as label_sets.csv and always multi-label
+    # this is necessary because we need access to every set of labels from every annotator.
+    # filtered_dataset is multi-label regardless of whether single_label is true because
+    # it wouldn't make sense to compare the krippendorff of a single-label dataset to a multi-label one
+    # and the starting dataset is always multi-label (and we are comparing against the starting dataset)
+
+    # binary copy of low_disagreement_dataset.csv for FastFit/SetFit (see Shared/dataset_artifact.py)
+    dataset_artifact.write_artifact(dataset_artifact.artifact_path("low_disagreement_dataset.csv"), kept_rows,
+                                    kept_refs, label_names, single_label=single_label)
 
     print("File written.")
 
@@ -223,14 +316,11 @@ def main():
     print(f"Validation: Krippendorff's alpha of previous multi-label dataset: {alpha_prev} with dataset length: {len(unfiltered_dataset)}")
     print(f"Validation: Krippendorff's alpha of new dataset: {alpha_new} with dataset length: {len(filtered_dataset)}")
 
-    """
-    kalphas = [1.0, 1.0, 1.0, 0.9611, 0.8743, 0.8431, 0.8071, 0.7436, 0.7126, 0.6795, 0.6611]
-    kalphas.reverse()
-    plt.plot([.0,.1,.2,.3,.4,.5,.6,.7,.8,.9,1], kalphas)
-    plt.xlabel("Agreement Threshold")
-    plt.ylabel("Alpha")
-    plt.show()
-    """
+    if bootstrap_resamples:
+        low_prev, high_prev = bootstrap_interval(unfiltered_dataset, bootstrap_resamples)
+        low_new, high_new = bootstrap_interval(filtered_dataset, bootstrap_resamples)
+        print(f"Validation: 95% confidence interval of previous alpha ({bootstrap_resamples} resamples): [{low_prev}, {high_prev}]")
+        print(f"Validation: 95% confidence interval of new alpha ({bootstrap_resamples} resamples): [{low_new}, {high_new}]")
 
 
 if __name__ == "__main__":
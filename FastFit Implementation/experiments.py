@@ -0,0 +1,193 @@
+# Repeated FastFit trials over a grid of shots, seeds and models
+#
+# Every (model, shot, seed) combination is one run: the split is drawn (or reused) with create_splits() in
+# model.py, and a FastFitTrainer is trained and evaluated on it in its own worker process. Runs are packed onto
+# the machine in slots: each slot gets its own slice of the CPU cores (threads pinned to them), so concurrent
+# runs don't fight over the same cores, and the next run starts as soon as a slot frees up.
+# Per-run metrics are appended to experiment_results.csv as runs finish, and runs that are already in there are
+# skipped, so an interrupted grid picks up where it left off. experiment_summary.csv then has the mean and
+# standard deviation of every (model, shot) over its seeds
+#
+# Run from this directory, with low_disagreement_dataset.csv next to it (see main() in model.py)
+
+import csv
+import multiprocessing
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+
+import numpy as np
+import torch
+from datasets import load_dataset
+from fastfit import FastFitTrainer
+
+# also puts Shared/ on the path (see model.py)
+import model
+import label_schema
+import run_profiler
+
+RESULTS = "experiment_results.csv"
+SUMMARY = "experiment_summary.csv"
+RUNS = "runs"  # per-run output (results.csv, raw_results.csv, confusion matrix, run_log.jsonl, trainer output)
+COLUMNS = ["model", "shot", "seed", "status", "f1", "train_size", "test_size", "train_seconds", "eval_seconds"]
+
+
+# The CPU cores this process may run on, split into workers slices of equal size
+def core_slots(workers):
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    per_slot = max(1, len(cores) // workers)
+    return [cores[(i * per_slot) % len(cores):(i * per_slot) % len(cores) + per_slot] for i in range(workers)]
+
+
+# Keep this process (and torch) on cores
+def pin_threads(cores):
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+
+
+# METHOD PARAMETERS
+# model_name, shot, seed: the run, see main()
+# train_path, test_path: the split of the run made by create_splits()
+# cores: the CPU cores the run is pinned to
+# RETURNS a row of experiment_results.csv (see COLUMNS)
+def run_experiment(model_name, shot, seed, train_path, test_path, cores):
+    pin_threads(cores)
+    row = {"model": model_name, "shot": shot, "seed": seed}
+    output_dir = os.path.join(RUNS, f"{model_name.replace('/', '_')}-shot{shot}-seed{seed}")
+    os.makedirs(output_dir, exist_ok=True)
+    profiler = run_profiler.RunProfiler(os.path.join(output_dir, run_profiler.RUN_LOG), script="FastFit experiments",
+                                        model=model_name, shot=shot, seed=seed, cores=list(cores))
+    try:
+        with profiler.phase("data load"):
+            dataset = load_dataset('csv', data_files={
+                "train": train_path,
+                "test": test_path
+            })
+        dataset["validation"] = dataset["test"]
+        row["train_size"] = len(dataset["train"])
+        row["test_size"] = len(dataset["test"])
+
+        # same hyperparameters as the final model in main() of model.py
+        with profiler.phase("model load"):
+            trainer = FastFitTrainer(
+                model_name_or_path=model_name,
+                learning_rate=7.99e-5,
+                num_train_epochs=50,
+                dataset=dataset,
+                optim="adafactor",
+                label_column_name="label",
+                text_column_name="text",
+                max_text_length=128,
+                dataloader_drop_last=False,
+                num_repeats=4,
+                output_dir=output_dir,
+                seed=seed,
+                compute_metrics=partial(model.compute_metrics, labels=label_schema.class_names(dataset["train"]["label"]),
+                                        output_dir=output_dir, show=False)
+            )
+        epochs = run_profiler.epoch_callback(profiler)
+        trainer.trainer.add_callback(epochs)
+
+        with profiler.phase("training") as training:
+            epochs.mark()
+            trainer.train()
+        row["train_seconds"] = training["seconds"]
+
+        with profiler.phase("evaluation", examples=row["test_size"]) as evaluation:
+            row["f1"] = trainer.evaluate()["eval_F1"]
+        row["eval_seconds"] = evaluation["seconds"]
+        row["status"] = "ok"
+    except Exception:
+        # one failed run shouldn't take down the rest of the grid, the traceback is kept with its output
+        with open(os.path.join(output_dir, "error.txt"), "w", encoding="utf-8") as error:
+            error.write(traceback.format_exc())
+        row["status"] = "failed"
+    profiler.end(status=row["status"])
+    return row
+
+
+# (model, shot, seed) of every run in experiment_results.csv that finished successfully
+def finished_runs():
+    if not os.path.exists(RESULTS):
+        return set()
+    with open(RESULTS, "r", encoding="utf-8", newline="") as results:
+        return {(row["model"], int(row["shot"]), int(row["seed"])) for row in csv.DictReader(results)
+                if row["status"] == "ok"}
+
+
+# Mean and standard deviation of the F1 of every (model, shot) over its seeds, from experiment_results.csv
+def summarize():
+    with open(RESULTS, "r", encoding="utf-8", newline="") as results:
+        rows = [row for row in csv.DictReader(results) if row["status"] == "ok"]
+    groups = {}
+    for row in rows:
+        groups.setdefault((row["model"], int(row["shot"])), {})[int(row["seed"])] = float(row["f1"])
+
+    with open(SUMMARY, "w", encoding="utf-8", newline="") as summary:
+        c_w = csv.writer(summary)
+        c_w.writerow(["model", "shot", "runs", "f1_mean", "f1_std"])
+        for (model_name, shot), f1s in sorted(groups.items()):
+            f1s = np.array(list(f1s.values()))
+            c_w.writerow([model_name, shot, len(f1s), f1s.mean(), f1s.std()])
+            print(f"{model_name} {shot}-shot: F1 {f1s.mean():.4f} +- {f1s.std():.4f} over {len(f1s)} seed(s)")
+
+
+def main():
+    # the grid, every combination is one run
+    shots = [5, 10]
+    seeds = [0, 1, 2, 3, 4]
+    model_names = ["sentence-transformers/all-mpnet-base-v2"]
+
+    # how many runs train at the same time, the CPU cores are split evenly between them
+    # (on a single GPU, FastFit puts every run on the same device, so keep this at 1 there)
+    workers = 4
+
+    slots = core_slots(workers)
+    # threads per run, inherited by every worker process (which is a fresh interpreter, see below) before it
+    # imports torch
+    for var in ["OMP_NUM_THREADS", "MKL_NUM_THREADS"]:
+        os.environ[var] = str(len(slots[0]))
+
+    done = finished_runs()
+    grid = [(model_name, shot, seed) for model_name in model_names for shot in shots for seed in seeds
+            if (model_name, shot, seed) not in done]
+    print(f"{len(grid)} run(s) to go, {len(done)} already in {RESULTS}")
+
+    # splits are drawn here rather than in the workers so that no two runs write the same split at once
+    # (the split only depends on shot and seed, not the model)
+    splits = {(shot, seed): model.create_splits(shot, seed=seed) for _, shot, seed in grid}
+
+    new_file = not os.path.exists(RESULTS)
+    with open(RESULTS, "a", encoding="utf-8", newline="") as results:
+        c_w = csv.DictWriter(results, fieldnames=COLUMNS)
+        if new_file:
+            c_w.writeheader()
+
+        # spawn: every run starts from a fresh interpreter rather than a fork of this one (and its torch state),
+        # and max_tasks_per_child=1 gives every run its own process
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 max_tasks_per_child=1) as pool:
+            free = list(range(workers))
+            running = {}
+            pending = list(grid)
+            while pending or running:
+                while pending and free:
+                    model_name, shot, seed = pending.pop(0)
+                    slot = free.pop(0)
+                    future = pool.submit(run_experiment, model_name, shot, seed, *splits[(shot, seed)], slots[slot])
+                    running[future] = slot
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    free.append(running.pop(future))
+                    row = future.result()
+                    c_w.writerow(row)
+                    results.flush()
+                    print(f"{row['model']} {row['shot']}-shot seed {row['seed']}: {row['status']}, F1 {row.get('f1')}")
+
+    summarize()
+
+
+if __name__ == "__main__":
+    main()
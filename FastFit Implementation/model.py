@@ -1,66 +1,117 @@
 from datasets import load_dataset
 from fastfit import FastFitTrainer
-import random
+import hashlib
+import shutil
+from functools import partial
 import csv
 import torch
 import numpy as np
 from sklearn.metrics import confusion_matrix, classification_report, f1_score, ConfusionMatrixDisplay
 from matplotlib import pyplot as plt
-import optuna
 import os
-
-
-def create_splits(shot):
-    # create 80/20 train and test splits
+import sys
+from pathlib import Path
+
+# modules shared between every stage of the pipeline live in Shared/ at the top of the repository
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Shared"))
+import dataset_artifact
+import label_schema
+import predict
+import run_profiler
+
+
+# Read the (text, label) rows of low_disagreement_dataset.csv, from its memory-mapped copy
+# (low_disagreement_dataset/) if Dataset Filtering wrote one, otherwise from the csv itself
+def read_low_disagreement_dataset():
+    artifact = dataset_artifact.open_artifact("low_disagreement_dataset.csv")
+    if artifact is not None:
+        assert artifact.single_label, "low_disagreement_dataset must be single-label for FastFit!"
+        return [[text, label] for text, label in zip(artifact.texts(), artifact.single_labels())]
     with open("low_disagreement_dataset.csv", "r", encoding="utf-8", newline="") as ds:
-        c_r = list(csv.reader(ds))
-        c_r = c_r[1:]
-        random.shuffle(c_r)
-
-        # FastFit internally treats the string label "None" as None (as in the null value),
-        # so circumvent that by changing the name of the label to No Issue
-        for row in c_r:
-            if row[1] == "None":
-                row[1] = "No Issue"
-
-        labels = [row[1] for row in c_r]
-
-        train = []
-        for label in set(labels):
-            if labels.count(label) < shot:
-                continue
-            count = 0
-            for row in c_r:
-                if row[1] == label:
-                    train.append(row)
-                    count += 1
-                if count == 10:
-                    break
-        train_labels = [row[1] for row in train]
-        test = [row for row in c_r if (row not in train and row[1] in set(train_labels))]
-
-        for row in train:
-            assert row not in test, "Test contains reflections from train!"
-
-        for label in set(train_labels):
-            assert train_labels.count(label) == 10, "Train does not contain ten of each label!"
-
-        test_labels = [row[1] for row in test]
-        for label in set(test_labels):
-            print(f"{label} label count in test: {test_labels.count(label)}")
-
-        with open("test.csv", "w", encoding="utf-8", newline="") as tst:
-            c_w = csv.writer(tst)
-            c_w.writerow(["text", "label"])
-            c_w.writerows(test)
-
-        with open("train.csv", "w", encoding="utf-8", newline="") as trn:
-            c_w = csv.writer(trn)
-            c_w.writerow(["text", "label"])
-            c_w.writerows(train)
-
-
-def compute_metrics(p) -> dict[str, float]:
+        return list(csv.reader(ds))[1:]
+
+
+# splits made by create_splits() are kept here, in one directory per (dataset hash, shot, seed)
+SPLIT_CACHE = "splits"
+
+
+# sha256 of the (text, label) rows of a dataset, so a split is only reused for exactly the same dataset
+def dataset_digest(rows):
+    digest = hashlib.sha256()
+    for text, label in rows:
+        digest.update(text.encode("utf-8") + b"\0" + label.encode("utf-8") + b"\n")
+    return digest.hexdigest()
+
+
+# Split low_disagreement_dataset.csv into a train split with shot reflections of every label that has at
+# least shot reflections, and a test split with every other reflection of those labels
+# The split is drawn with a numpy Generator seeded with seed, so the same dataset, shot and seed always give
+# the same split, and it is saved to SPLIT_CACHE/<dataset hash>-shot<shot>-seed<seed>/ so that it's only ever
+# drawn once. Returns the paths of the train and test csvs
+def create_splits(shot, seed=0):
+    c_r = read_low_disagreement_dataset()
+    path = f"{SPLIT_CACHE}/{dataset_digest(c_r)}-shot{shot}-seed{seed}"
+    if os.path.exists(f"{path}/train.csv") and os.path.exists(f"{path}/test.csv"):
+        print(f"Using the split in {path}")
+        return f"{path}/train.csv", f"{path}/test.csv"
+    print(f"Generating split {path}...")
+
+    # FastFit internally treats the string label "None" as None (as in the null value),
+    # so circumvent that by changing the name of the label to No Issue (see DISPLAY_NAMES in Shared/label_schema.py)
+    c_r = [[row[0], label_schema.display_name(row[1])] for row in c_r]
+
+    # index every label once: after shuffling, a stable sort by label puts the reflections of each label
+    # next to each other in shuffled order, so the first shot of each group are a random sample of that label
+    label_names, label_ids = np.unique(np.array([row[1] for row in c_r], dtype=object), return_inverse=True)
+    label_ids = label_ids.reshape(-1)
+    shuffled = np.random.default_rng(seed).permutation(len(c_r))
+    grouped = shuffled[np.argsort(label_ids[shuffled], kind="stable")]
+    counts = np.bincount(label_ids, minlength=len(label_names))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    in_train = np.zeros(len(c_r), dtype=bool)
+    for label in np.flatnonzero(counts >= shot).tolist():
+        in_train[grouped[starts[label]:starts[label] + shot]] = True
+    train = [c_r[i] for i in shuffled.tolist() if in_train[i]]
+
+    # the test split is every other reflection of the labels in train, minus exact copies of train rows
+    train_rows = {tuple(row) for row in train}
+    in_train_labels = (counts >= shot)[label_ids]
+    test = [c_r[i] for i in shuffled.tolist() if in_train_labels[i] and not in_train[i] and tuple(c_r[i]) not in train_rows]
+
+    assert not train_rows & {tuple(row) for row in test}, "Test contains reflections from train!"
+    train_counts = np.bincount(label_ids[in_train], minlength=len(label_names))
+    assert np.all(train_counts[counts >= shot] == shot), f"Train does not contain {shot} of each label!"
+
+    test_labels = [row[1] for row in test]
+    for label, count in zip(*np.unique(np.array(test_labels, dtype=object), return_counts=True)):
+        print(f"{label} label count in test: {count}")
+
+    # written to a temporary directory that is renamed at the end, so a split is either complete or not there
+    os.makedirs(SPLIT_CACHE, exist_ok=True)
+    tmp = f"{path}.tmp"
+    os.makedirs(tmp, exist_ok=True)
+    with open(f"{tmp}/test.csv", "w", encoding="utf-8", newline="") as tst:
+        c_w = csv.writer(tst)
+        c_w.writerow(["text", "label"])
+        c_w.writerows(test)
+
+    with open(f"{tmp}/train.csv", "w", encoding="utf-8", newline="") as trn:
+        c_w = csv.writer(trn)
+        c_w.writerow(["text", "label"])
+        c_w.writerows(train)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+
+    return f"{path}/train.csv", f"{path}/test.csv"
+
+
+# labels: class names in the order FastFit numbers them (label_schema.class_names() of the train split)
+# output_dir: where raw_results.csv and results.csv are written
+# show: show the confusion matrix, otherwise it's saved to output_dir/confusion_matrix.png (e.g. for runs in
+# worker processes, see experiments.py)
+def compute_metrics(p, labels, output_dir=".", show=True) -> dict[str, float]:
     predictions = (p.predictions[0] if isinstance(p.predictions, tuple) else p.predictions)
     predictions = np.argmax(predictions, axis=1)
 
@@ -68,10 +119,7 @@ def compute_metrics(p) -> dict[str, float]:
 
     print(references)
 
-    labels = ["API", 'Course Structure and Materials', 'Github', 'Group Work', 'MySQL', 'No Issue',
-              'Python and Coding', 'Time Management and Motivation']
-
-    with open("raw_results.csv", "w", encoding="utf-8", newline="") as rr:
+    with open(os.path.join(output_dir, "raw_results.csv"), "w", encoding="utf-8", newline="") as rr:
         c_w = csv.writer(rr)
         for pred in predictions:
             c_w.writerow([labels[pred]])
@@ -81,7 +129,7 @@ def compute_metrics(p) -> dict[str, float]:
     f1 = f1_score(references, predictions, average="macro")
     assert f1 == f1_score(predictions, references, average="macro"), f"Not equal, {f1_score(predictions, references, average='macro')}"
 
-    with open("results.csv", "w", encoding="utf-8", newline="") as results:
+    with open(os.path.join(output_dir, "results.csv"), "w", encoding="utf-8", newline="") as results:
         c_w = csv.writer(results)
         c_w.writerow(labels)
         for row in matrix:
@@ -100,7 +148,11 @@ def compute_metrics(p) -> dict[str, float]:
 
     display = ConfusionMatrixDisplay(confusion_matrix=matrix, display_labels=labels)
     display.plot()
-    plt.show()
+    if show:
+        plt.show()
+    else:
+        plt.savefig(os.path.join(output_dir, "confusion_matrix.png"))
+        plt.close()
 
     return {"F1": f1}
 
@@ -121,8 +173,12 @@ def main():
     # train and test splits based on the shot variable, which is how many examples per label class will
     # be in train (ie a shot of 10 means 10 example reflections for each label class in train.csv).
     # The rest of the reflections in the dataset will go to the test split.
-    # You can also run a hyperparameter search by uncommenting the code below objective() -- if needed,
-    # alter the search space by changing the arguments to suggest_float() and suggest_categorical() in objective().
+    # Splits are drawn with the seed variable and saved under splits/ (see create_splits()), so rerunning with the
+    # same dataset, shot and seed reuses the same split instead of drawing a new one
+    # To repeat the final model over several shots, seeds and models and average the results, use experiments.py
+    # You can also run a hyperparameter search with search.py -- if needed, alter the search space by changing
+    # the arguments to suggest_float() and suggest_categorical() in objective() there.
+    # In a study of 20 trials, I found that 7e-5 base learning rate and 50 epochs was optimal
     # Hyperparameters can also be set manually in the FastFitTrainer constructor call.
 
     # If this prints False, make sure you have CUDA installed + a CUDA capable GPU + the CUDA version of PyTorch
@@ -131,77 +187,59 @@ def main():
     # how many samples to select per label class, ie "10-shot" or "5-shot"
     shot = 10
 
-    if not os.path.exists("test.csv") and not os.path.exists("train.csv"):
-        print("Generating splits...")
-        create_splits(shot)
+    # seed for drawing the split, the same shot and seed always give the same split (see create_splits())
+    seed = 0
 
-    dataset = load_dataset('csv', data_files={
-        "train": "train.csv",
-        "test": "test.csv"
-    })
+    model_name = "sentence-transformers/all-mpnet-base-v2"
 
-    dataset["validation"] = dataset["test"]
+    # where the time (and memory) of every phase of the run goes, see Shared/run_profiler.py
+    profiler = run_profiler.RunProfiler(script="FastFit", model=model_name, shot=shot, seed=seed)
+
+    with profiler.phase("data load") as data_load:
+        train_path, test_path = create_splits(shot, seed=seed)
 
-    def objective(trial):
-        lr = trial.suggest_float("lr", 1e-5, 1e-3, log=True)
-        epochs = trial.suggest_categorical("epochs", [40, 50, 60])
-        # repeats is a major bottleneck to training time at >4
-        # repeats = trial.suggest_categorical("repeats", [4, 5, 6, 7])
+        dataset = load_dataset('csv', data_files={
+            "train": train_path,
+            "test": test_path
+        })
+        data_load["examples"] = len(dataset["train"]) + len(dataset["test"])
 
-        print(f"Learning rate: {lr}")
-        print(f"Epoch: {epochs}")
-        # print(f"Repeats: {repeats}")
+    dataset["validation"] = dataset["test"]
+    # the class ids predicted by the model are turned back into label names with this
+    class_labels = label_schema.class_names(dataset["train"]["label"])
+    compute_metrics_for_labels = partial(compute_metrics, labels=class_labels)
 
-        search_trainer = FastFitTrainer(
-            model_name_or_path="sentence-transformers/all-MiniLM-L12-v2",
-            learning_rate=lr,
-            num_train_epochs=epochs,
+    # Looking at the FastFit source code, the device is set to cuda internally
+    # We don't have to set it ourselves like with SetFit
+    with profiler.phase("model load"):
+        trainer = FastFitTrainer(
+            model_name_or_path=model_name,
+            learning_rate=7.99e-5,  # best_params["lr"],
+            num_train_epochs=50,  # best_params["epochs"],
             dataset=dataset,
             optim="adafactor",
             label_column_name="label",
             text_column_name="text",
-            max_text_length=128,
+            max_text_length=128,  # 128 suggested by FastFit developer
             dataloader_drop_last=False,
-            num_repeats=4,  # number suggested by the FastFit developers
-            compute_metrics=compute_metrics
+            num_repeats=4,  # best_params["repeats"]
+            compute_metrics=compute_metrics_for_labels  # <-- see instructions at top of main()
         )
+    epochs = run_profiler.epoch_callback(profiler)
+    trainer.trainer.add_callback(epochs)
 
-        search_trainer.train()
-        f1 = search_trainer.evaluate()["eval_F1"]
-
-        print(f"Trial result: {f1}")
+    with profiler.phase("training"):
+        epochs.mark()
+        trainer.train()
 
-        return f1
+    with profiler.phase("evaluation", examples=len(dataset["test"])):
+        trainer.evaluate()
 
-    """
-    # Uncomment to run hyperparameter search (optimizing the f1 score)
-    # In a study of 20 trials, I found that 7e-5 base learning rate and 50 epochs was optimal
-    study = optuna.create_study(direction="maximize")
-    study.optimize(objective, n_trials=20)
-    best_params = study.best_params
-    """
+    # save the trained model for CPU inference (see predict.py, which also checks it against the predictions above)
+    predict.export(trainer, "exported_model", class_labels, max_text_length=128, test_path=test_path)
 
-    # Looking at the FastFit source code, the device is set to cuda internally
-    # We don't have to set it ourselves like with SetFit
-    trainer = FastFitTrainer(
-        model_name_or_path="sentence-transformers/all-mpnet-base-v2",
-        learning_rate=7.99e-5,  # best_params["lr"],
-        num_train_epochs=50,  # best_params["epochs"],
-        dataset=dataset,
-        optim="adafactor",
-        label_column_name="label",
-        text_column_name="text",
-        max_text_length=128,  # 128 suggested by FastFit developer
-        dataloader_drop_last=False,
-        num_repeats=4,  # best_params["repeats"]
-        compute_metrics=compute_metrics  # <-- see instructions at top of main()
-    )
-
-    trainer.train()
-
-    print(torch.cuda.memory_summary())
-
-    trainer.evaluate()
+    profiler.end()
+    print(f"Phase times written to {profiler.path}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,118 @@
+# CPU inference for a trained FastFit model
+#
+# export() saves the model trained in main() of model.py (encoder + label embeddings, see FastFit's
+# export_model()) and its tokenizer to a directory, and Predictor loads it back onto the CPU, in fp32 or with
+# its linear layers dynamically quantized to int8 (see Shared/cpu_inference.py), and classifies reflections
+# in batches of reflections of similar length (see length_batches() in Shared/cpu_inference.py).
+# Running this script checks an exported model against the predictions trainer.evaluate() wrote to
+# raw_results.csv for the test split the model was exported with (the fp32 and int8 predictions both have to
+# agree with them within tolerance, and length bucketing can't change a single prediction), writes the
+# latency/throughput of every variant to inference_benchmark.csv and the metrics of the int8 model to cpu_results/
+#
+# Run from this directory after main() in model.py, which exports the model to exported_model/
+
+import csv
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import torch
+from fastfit import FastFit
+from transformers import AutoTokenizer, EvalPrediction
+
+# modules shared between every stage of the pipeline live in Shared/ at the top of the repository
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Shared"))
+import cpu_inference
+
+
+# METHOD PARAMETERS
+# trainer: the trained FastFitTrainer
+# path: directory to export to
+# labels: class names in the order the model numbers them (the labels compute_metrics() was given)
+# max_text_length: the max_text_length the model was trained with
+# test_path: the test split the model was evaluated on
+def export(trainer, path, labels, max_text_length, test_path):
+    trainer.export_model().save_pretrained(path)
+    trainer.tokenizer.save_pretrained(path)
+    cpu_inference.write_export_info(path, {"labels": list(labels), "max_text_length": max_text_length,
+                                           "test_path": test_path})
+    print(f"Model exported to {path}")
+
+
+class Predictor:
+    # path: directory the model was exported to, quantized: load the int8 model instead of the fp32 one
+    # bucket_by_length: batch reflections of similar token length together, otherwise they're batched in order
+    def __init__(self, path, quantized=False, batch_size=64, bucket_by_length=True):
+        info = cpu_inference.read_export_info(path)
+        self.labels = info["labels"]
+        self.max_text_length = info["max_text_length"]
+        self.batch_size = batch_size
+        self.bucket_by_length = bucket_by_length
+        self.tokenizer = AutoTokenizer.from_pretrained(path)
+        self.model = FastFit.from_pretrained(path).to("cpu").eval()
+        if quantized:
+            self.model = cpu_inference.quantize(self.model)
+
+    # (len(texts) x num_labels) array of class scores, in the order of texts
+    def logits(self, texts):
+        texts = list(texts)
+        scores = np.zeros((len(texts), len(self.labels)), dtype=np.float32)
+        if not texts:
+            return scores
+        # everything is tokenized once up front (unpadded), every batch is then only padded to its longest reflection
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_text_length)
+        if self.bucket_by_length:
+            order = cpu_inference.length_batches([len(ids) for ids in encoded["input_ids"]], self.batch_size)
+        else:
+            order = cpu_inference.batches(np.arange(len(texts)), self.batch_size)
+        with torch.inference_mode():
+            for batch in order:
+                inputs = self.tokenizer.pad({key: [values[i] for i in batch.tolist()] for key, values in encoded.items()},
+                                            return_tensors="pt")
+                scores[batch] = self.model(**inputs).logits.float().numpy()
+        return scores
+
+    # predicted label name of every text
+    def predict(self, texts):
+        return [self.labels[i] for i in np.argmax(self.logits(texts), axis=1).tolist()]
+
+
+def main():
+    # where main() in model.py exported the model
+    export_path = "exported_model"
+    # largest fraction of predictions allowed to differ from what trainer.evaluate() predicted
+    tolerance = 0.02
+
+    with open(cpu_inference.read_export_info(export_path)["test_path"], "r", encoding="utf-8", newline="") as test:
+        rows = list(csv.reader(test))[1:]
+    texts = [row[0] for row in rows]
+    # raw_results.csv has one label per row, in test split order
+    reference = cpu_inference.read_raw_predictions("raw_results.csv")
+
+    timings = {}
+    predictions = {}
+    # the first variant is the baseline the speedups in inference_benchmark.csv are relative to
+    for variant, quantized, bucket_by_length in [("fp32, csv order", False, False), ("fp32", False, True),
+                                                 ("int8", True, True)]:
+        predictor = Predictor(export_path, quantized=quantized, bucket_by_length=bucket_by_length)
+        predictions[variant] = [[label] for label in predictor.predict(texts)]
+        cpu_inference.compare(variant, predictions[variant], "trainer.evaluate()", reference, tolerance)
+        timings[variant] = cpu_inference.benchmark(predictor.predict, texts, predictor.batch_size)
+    cpu_inference.compare("fp32", predictions["fp32"], "fp32, csv order", predictions["fp32, csv order"], 0)
+    cpu_inference.compare("int8", predictions["int8"], "fp32", predictions["fp32"], tolerance)
+
+    cpu_inference.write_benchmark("inference_benchmark.csv", timings)
+
+    # metrics of the int8 model, computed by the same compute_metrics() as trainer.evaluate() (logits() returns the
+    # scores in test split order, whatever order they were batched in)
+    # imported here since model.py imports this module
+    from model import compute_metrics
+    os.makedirs("cpu_results", exist_ok=True)
+    label_ids = np.array([predictor.labels.index(row[1]) for row in rows])
+    print(compute_metrics(EvalPrediction(predictions=predictor.logits(texts), label_ids=label_ids), predictor.labels,
+                          output_dir="cpu_results", show=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# Hyperparameter search for FastFit
+#
+# The study is kept in a local SQLite database (optuna_search.db), so every finished trial is saved as soon as it
+# finishes, and rerunning this script resumes the study instead of starting over (trials that were running
+# when a search crashed are noticed through their missing heartbeat and retried once).
+# Every trial evaluates after each epoch and reports the eval F1 to the study, so the pruner can stop trials
+# that are doing worse than the median trial at the same epoch, instead of training all 40-60 epochs of them.
+# The trials are shared between worker processes (each pinned to its own slice of the CPU cores, see
+# experiments.py), which all pull trials from the same study
+#
+# Run from this directory, with low_disagreement_dataset.csv next to it (see main() in model.py)
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import optuna
+from optuna.storages import RDBStorage, RetryFailedTrialCallback
+from optuna.study import MaxTrialsCallback
+from optuna.trial import TrialState
+from datasets import load_dataset
+from fastfit import FastFitTrainer
+from transformers import TrainerCallback
+
+# also puts Shared/ on the path (see model.py)
+import model
+import label_schema
+from experiments import core_slots, pin_threads
+
+STUDY_NAME = "fastfit"
+STORAGE = "sqlite:///optuna_search.db"
+TRIALS = "trials"  # per-trial output (results.csv of the last evaluation, trainer output)
+
+
+# Reports the eval F1 of every epoch's evaluation to the trial, and stops training if the pruner says so
+class PruningCallback(TrainerCallback):
+    def __init__(self, trial):
+        self.trial = trial
+
+    def on_evaluate(self, args, state, control, metrics=None, **kwargs):
+        epoch = round(state.epoch)
+        self.trial.report(metrics["eval_F1"], step=epoch)
+        if self.trial.should_prune():
+            raise optuna.TrialPruned(f"Pruned at epoch {epoch} with F1 {metrics['eval_F1']}")
+
+
+def storage():
+    # SQLite only lets one connection write at a time, so wait for the other workers instead of failing
+    return RDBStorage(STORAGE, engine_kwargs={"connect_args": {"timeout": 60}},
+                      heartbeat_interval=60, grace_period=180,
+                      failed_trial_callback=RetryFailedTrialCallback(max_retry=1))
+
+
+# MedianPruner: prune a trial once its F1 at an epoch is below the median F1 of the earlier trials at that
+# epoch, but only after the first 5 trials have finished and never in a trial's first 5 epochs
+# The pruner isn't saved with the study, so every create_study()/load_study() has to be given this one
+def make_pruner():
+    return optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=5)
+
+
+def objective(trial, dataset):
+    lr = trial.suggest_float("lr", 1e-5, 1e-3, log=True)
+    epochs = trial.suggest_categorical("epochs", [40, 50, 60])
+    # repeats is a major bottleneck to training time at >4
+    # repeats = trial.suggest_categorical("repeats", [4, 5, 6, 7])
+
+    print(f"Trial {trial.number}, learning rate: {lr}, epochs: {epochs}")
+
+    output_dir = os.path.join(TRIALS, str(trial.number))
+    os.makedirs(output_dir, exist_ok=True)
+    search_trainer = FastFitTrainer(
+        model_name_or_path="sentence-transformers/all-MiniLM-L12-v2",
+        learning_rate=lr,
+        num_train_epochs=epochs,
+        dataset=dataset,
+        optim="adafactor",
+        label_column_name="label",
+        text_column_name="text",
+        max_text_length=128,
+        dataloader_drop_last=False,
+        num_repeats=4,  # number suggested by the FastFit developers
+        output_dir=output_dir,
+        evaluation_strategy="epoch",  # evaluate after every epoch for PruningCallback
+        save_strategy="no",
+        compute_metrics=partial(model.compute_metrics, labels=label_schema.class_names(dataset["train"]["label"]),
+                                output_dir=output_dir, show=False)
+    )
+    pruning = PruningCallback(trial)
+    search_trainer.trainer.add_callback(pruning)
+
+    search_trainer.train()
+    # training is done, so the final evaluation must not report the last epoch again (or prune a finished trial)
+    search_trainer.trainer.remove_callback(pruning)
+    f1 = search_trainer.evaluate()["eval_F1"]
+
+    print(f"Trial {trial.number} result: {f1}")
+
+    return f1
+
+
+# One worker process: pull trials from the study until it has n_trials finished (complete or pruned) trials
+def run_worker(n_trials, train_path, test_path, cores):
+    pin_threads(cores)
+    dataset = load_dataset('csv', data_files={
+        "train": train_path,
+        "test": test_path
+    })
+    dataset["validation"] = dataset["test"]
+
+    study = optuna.load_study(study_name=STUDY_NAME, storage=storage(), pruner=make_pruner())
+    study.optimize(partial(objective, dataset=dataset),
+                   callbacks=[MaxTrialsCallback(n_trials, states=(TrialState.COMPLETE, TrialState.PRUNED))])
+
+
+def main():
+    # trials in the whole study (including the ones from earlier runs of the search), alter the search space in
+    # objective()
+    n_trials = 40
+
+    # the split the search is run on (see create_splits() in model.py)
+    shot = 10
+    seed = 0
+
+    # how many trials train at the same time, the CPU cores are split evenly between them
+    # (on a single GPU, FastFit puts every trial on the same device, so keep this at 1 there)
+    workers = 4
+
+    optuna.create_study(study_name=STUDY_NAME, storage=storage(), direction="maximize", load_if_exists=True,
+                        pruner=make_pruner())
+
+    train_path, test_path = model.create_splits(shot, seed=seed)
+
+    slots = core_slots(workers)
+    # threads per trial, inherited by every worker process before it imports torch
+    for var in ["OMP_NUM_THREADS", "MKL_NUM_THREADS"]:
+        os.environ[var] = str(len(slots[0]))
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        for future in [pool.submit(run_worker, n_trials, train_path, test_path, slot) for slot in slots]:
+            future.result()
+
+    study = optuna.load_study(study_name=STUDY_NAME, storage=storage(), pruner=make_pruner())
+    pruned = len(study.get_trials(deepcopy=False, states=(TrialState.PRUNED,)))
+    print(f"{len(study.trials)} trials, {pruned} pruned")
+    print(f"Best trial: {study.best_trial.number}, F1 {study.best_value}")
+    print(f"Best params: {study.best_params}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+# Serve a model exported by main() in model.py (see predict.py) with the micro-batching classification server in
+# Shared/classification_server.py, which loads the model once and classifies concurrent requests together, e.g.
+#   curl -X POST localhost:8000/classify -d '{"texts": ["my venv does not activate"]}'
+# returns {"labels": [...]}, one label name per reflection, named the same way as in compute_metrics()
+#
+# Run from this directory
+
+import sys
+from pathlib import Path
+
+# modules shared between every stage of the pipeline live in Shared/ at the top of the repository
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Shared"))
+import classification_server
+import predict
+
+
+def main():
+    export_path = "exported_model"
+    # serve the int8 model (see Shared/cpu_inference.py), set to False for the fp32 one
+    quantized = True
+
+    # where to listen: host/port, or a Unix socket path if unix_socket is set
+    host = "127.0.0.1"
+    port = 8000
+    unix_socket = None
+
+    # most reflections classified at once, and the longest a request waits for others to batch with (in seconds)
+    max_batch_size = 64
+    max_wait = 0.01
+
+    predictor = predict.Predictor(export_path, quantized=quantized, batch_size=max_batch_size)
+    classification_server.serve(predictor.predict, host=host, port=port, unix_socket=unix_socket,
+                                max_batch_size=max_batch_size, max_wait=max_wait)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,12 @@ from openai import OpenAI
 import csv
 import numpy as np
 from sklearn.metrics import multilabel_confusion_matrix
+import sys
+from pathlib import Path
+
+# modules shared between every stage of the pipeline live in Shared/ at the top of the repository
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Shared"))
+import label_schema
 
 # using the OpenAI API to prompt GPT-x models for multi-label classification of data
 
@@ -19,29 +25,14 @@ questions = [
     "Do you have any current challenges in the course? If so, what are they?"
 ]
 
-# all labels for reference:
-"""
-    "None",
+# all labels for reference: SUPERSET in Shared/label_schema.py
+# canonical() makes sure these are spelled the same way as in the datasets
+labels = label_schema.canonical([
     "Python and Coding",
     "Github",
-    "MySQL",
     "Assignments",
-    "Quizzes",
-    "Understanding requirements and instructions",
-    "Learning New Material",
-    "Course Structure and Materials",
     "Time Management and Motivation",
-    "Group Work",
-    "API",
-    "Project"
-"""
-
-labels = [
-    "Python and Coding",
-    "Github",
-    "Assignments",
-    "Time Management and Motivation",
-]
+])
 
 
 def prompt_model(refs, num_preds, temperature=None):
@@ -1,5 +1,6 @@
 import matplotlib.pyplot as plt
 import csv
+import json
 from pathlib import Path
 
 
@@ -27,7 +28,65 @@ def resolve_list(averages):
     return averages
 
 
+# Read the records of every run log (run_log.jsonl written by the FastFit and SetFit scripts, see
+# Shared/run_profiler.py) in files into {run id: [records of the run]}
+def read_run_logs(files):
+    runs = {}
+    for file in files:
+        with open(file, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    runs.setdefault(record["run"], []).append(record)
+    return runs
+
+
+# Print where the time of every run went, and plot it as one stacked bar per run
+def plot_run_logs(runs):
+    names = []
+    phase_times = {}
+    for i, (run, records) in enumerate(sorted(runs.items())):
+        start = next((record for record in records if record["event"] == "start"), {})
+        end = next((record for record in records if record["event"] == "end"), {})
+        name = " ".join(str(start[key]) for key in ["script", "model", "shot", "seed"] if key in start) or run
+        names.append(f"{name}\n{run}")
+
+        print(f"{name} ({run}), torch threads: {start.get('torch_num_threads')}, "
+              f"total: {end.get('seconds', float('nan')):.1f}s, peak RSS: {end.get('peak_rss_mb')} MB")
+        phases = [record for record in records if record["event"] == "phase"]
+        epochs = [record for record in phases if record["phase"] == "epoch"]
+        # phases recorded inside another one (the epochs and the setup before the first of them, e.g. pair
+        # generation, are part of the training phase) are only listed under it and not plotted on top of it
+        nested = [record for record in phases if record.get("within") and record["phase"] != "epoch"]
+        for record in phases:
+            if record.get("within") or record["phase"] == "epoch":
+                continue
+            throughput = record.get("examples_per_second")
+            print(f"    {record['phase']}: {record['seconds']:.2f}s"
+                  + (f", {throughput:.1f} examples/s" if throughput else ""))
+            phase_times.setdefault(record["phase"], [0.0] * len(runs))[i] += record["seconds"]
+            for sub in [sub for sub in nested if sub["within"] == record["phase"]]:
+                print(f"        {sub['phase']}: {sub['seconds']:.2f}s")
+            if epochs and record["phase"] == "training":
+                seconds = [epoch["seconds"] for epoch in epochs]
+                print(f"        {len(epochs)} epochs: {sum(seconds) / len(seconds):.2f}s mean, {max(seconds):.2f}s max")
+
+    bottom = [0.0] * len(runs)
+    for phase, seconds in phase_times.items():
+        plt.bar(names, seconds, bottom=bottom, label=phase)
+        bottom = [b + s for b, s in zip(bottom, seconds)]
+    plt.ylabel("Seconds")
+    plt.legend()
+    plt.title("Time per phase of every run")
+    plt.show()
+
+
 def main():
+    # run logs of FastFit/SetFit runs (their run_log.jsonl files) go in run_logs/
+    run_logs = sorted(Path("run_logs").glob("*.jsonl"))
+    if run_logs:
+        plot_run_logs(read_run_logs(run_logs))
+
     gpt_data = Path("gpt_data").glob("*")
     setfit_data = Path("setfit-data").glob("*")
 
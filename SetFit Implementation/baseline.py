@@ -0,0 +1,80 @@
+# Head-only baseline: SetFit without the contrastive fine-tuning of the sentence transformer
+#
+# The reflections are embedded with the base sentence transformer as is, and only the classification head
+# (logistic regression, SetFit's default head) is trained on the embeddings. Since the encoder never changes, the
+# embeddings come from the persistent embedding cache (see Shared/embedding_cache.py), so after the first run the
+# encoder isn't run at all and a baseline takes as long as fitting a logistic regression.
+# Works with the multi-label SetFit splits (label columns + "text") as well as with single-label (text, label)
+# splits like the ones FastFit trains on (FastFit Implementation/splits/)
+#
+# Run from this directory
+
+import csv
+import sys
+from pathlib import Path
+
+import numpy
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import f1_score, accuracy_score
+from sklearn.multiclass import OneVsRestClassifier
+
+# modules shared between every stage of the pipeline live in Shared/ at the top of the repository
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Shared"))
+import embedding_cache
+
+
+# Texts and labels of a split csv: a (len x num_labels) 0/1 matrix for multi-label splits, label names for
+# single-label ones. Returns (texts, labels, label_names)
+def read_split(path):
+    with open(path, "r", encoding="utf-8", newline="") as split:
+        c_r = list(csv.reader(split))
+    header, rows = c_r[0], c_r[1:]
+    texts = [row[header.index("text")] for row in rows]
+    if header == ["text", "label"]:
+        return texts, numpy.array([row[1] for row in rows], dtype=object), sorted({row[1] for row in rows})
+    columns = [i for i, name in enumerate(header) if name != "text"]
+    matrix = numpy.array([[row[i] for i in columns] for row in rows], dtype=numpy.int64).reshape(len(rows), len(columns))
+    return texts, matrix, [header[i] for i in columns]
+
+
+def main():
+    # the splits to train and evaluate the head on
+    train_path = "data-splits/setfit-dataset-train.csv"
+    test_path = "data-splits/setfit-dataset-test.csv"
+
+    # the base sentence transformer (the one model_init() in model.py fine-tunes) and the max sequence length
+    # reflections are truncated to
+    model_name = "sentence-transformers/all-MiniLM-L12-v2"
+    max_length = 128
+
+    train_texts, train_labels, label_names = read_split(train_path)
+    test_texts, test_labels, _ = read_split(test_path)
+
+    print("Embedding...")
+    cache = embedding_cache.EmbeddingCache(model_name, max_length)
+    encode = embedding_cache.sentence_transformer_encoder(model_name, max_length)
+    cached = int(numpy.sum(cache.lookup(train_texts + test_texts) >= 0))
+    print(f"{cached} of {len(train_texts) + len(test_texts)} reflections already in {cache.path}")
+    x_train = cache.embeddings(train_texts, encode=encode).astype(numpy.float32)
+    x_test = cache.embeddings(test_texts, encode=encode).astype(numpy.float32)
+
+    print("Training head...")
+    head = LogisticRegression(max_iter=1000)
+    if train_labels.ndim == 2:  # multi-label: one logistic regression per label
+        head = OneVsRestClassifier(head)
+    head.fit(x_train, train_labels)
+    predictions = head.predict(x_test)
+
+    f1 = f1_score(test_labels, predictions, average="macro")
+    accuracy = accuracy_score(test_labels, predictions)
+    print(f"Head-only baseline with {model_name}: macro F1 {f1}, accuracy {accuracy}")
+
+    with open("baseline_results.csv", "w", encoding="utf-8", newline="") as results:
+        c_w = csv.writer(results)
+        c_w.writerow(["model", "labels", "train_size", "test_size", "f1", "accuracy"])
+        c_w.writerow([model_name, len(label_names), len(train_texts), len(test_texts), f1, accuracy])
+    print("Results written to baseline_results.csv")
+
+
+if __name__ == "__main__":
+    main()
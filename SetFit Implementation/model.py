@@ -1,22 +1,32 @@
-from datasets import load_dataset
+from datasets import Dataset, DatasetDict, load_dataset
 from setfit import SetFitModel, Trainer, TrainingArguments
 from sklearn.metrics import multilabel_confusion_matrix, confusion_matrix, ConfusionMatrixDisplay, f1_score, classification_report
 from optuna import Trial
 import numpy
 import csv
+import os
+from functools import partial
 import torch
+import sys
+from pathlib import Path
 from matplotlib import pyplot as plt
 
+# modules shared between every stage of the pipeline live in Shared/ at the top of the repository
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Shared"))
+import dataset_artifact
+import label_schema
+import predict
+import run_profiler
+
 
 # Generate a confusion matrix for each label in the dataset. For each column/vector
 # in the label_num by reflection_num matrix of predictions output by the model,
 # one confusion matrix will be created. That will represent the confusion for
 # that label. Repeat process for each label. Hopefully, with enough predictions
 # for each class, a minimally noisy confusion matrix can be created for each label
-def compute_metrics(y_pred, y_true) -> dict[str, float]:
-    # initialize labels
-    labels = ["API", 'Course Structure and Materials', 'Github', 'Group Work', 'MySQL', 'No Issue',
-              'Python and Coding', 'Time Management and Motivation']
+# labels: the label of every column of y_pred for multi-label datasets, or the class names in the
+# order the classes are numbered for single-label ones (set in main())
+def compute_metrics(y_pred, y_true, labels) -> dict[str, float]:
     if not any(item in y_true for item in [i for i in range(2, max(y_true))]):  # MULTI-LABEL CASE if y_true doesn't contain numbers other than 0,1
         # save the raw predictions made by the model
         with open("raw_setfit_preds.csv", "w", encoding="utf-8", newline='') as rsp:
@@ -87,10 +97,40 @@ def compute_metrics(y_pred, y_true) -> dict[str, float]:
         return {"F1": f1}
 
 
+# Class names of a single-label dataset in the order its classes are numbered. The label column of the csv splits
+# only holds class ids, so their names are read from class_path, which is saved with the splits (one class name
+# per line, in id order)
+def single_label_classes(class_path):
+    assert os.path.exists(class_path), f"The splits only hold class ids, {class_path} with the name of every id is missing!"
+    with open(class_path, "r", encoding="utf-8") as classes:
+        return [label_schema.display_name(line.strip()) for line in classes if line.strip()]
+
+
+# Load a dataset split from the memory-mapped copy of its csv (see Shared/dataset_artifact.py), with the same
+# columns load_dataset('csv') would give: the label columns + "text" for multi-label datasets, or "text" and
+# "label" for single-label ones. Returns None if the split has no binary copy
+# (python Shared/dataset_artifact.py <split.csv> creates one)
+# class_path: the class names of single-label splits, see single_label_classes()
+def load_split(csv_path, class_path):
+    artifact = dataset_artifact.open_artifact(csv_path)
+    if artifact is None:
+        return None
+    if artifact.single_label:
+        # the artifact has label names, they get the same class ids as in the csv
+        class_ids = {name: i for i, name in enumerate(single_label_classes(class_path))}
+        names = [label_schema.display_name(label) for label in artifact.single_labels()]
+        assert all(name in class_ids for name in names), f"{csv_path} has classes that aren't in {class_path}!"
+        return Dataset.from_dict({"text": artifact.texts(), "label": [class_ids[name] for name in names]})
+    columns = {label: artifact.matrix[:, i].astype(numpy.int64) for i, label in enumerate(artifact.labels)}
+    columns["text"] = artifact.texts()
+    return Dataset.from_dict(columns)
+
+
 # model instantiation for each trial run of the hyperparameter search
 def model_init(params):
+    # falls back to the CPU on machines without a GPU (see predict.py for CPU inference with a trained model)
     params = {  # "multi_target_strategy": "one-vs-rest",
-              "device": torch.device("cuda")}
+              "device": torch.device("cuda" if torch.cuda.is_available() else "cpu")}
     # all-MiniLM-L12-v2 is 33.6M params
     return SetFitModel.from_pretrained("sentence-transformers/all-MiniLM-L12-v2", **params)
 
@@ -108,22 +148,38 @@ def main():
     # loosely followed https://github.com/NielsRogge/Transformers-Tutorials/blob/master/BERT/Fine_tuning_BERT_(and_friends)_for_multi_label_text_classification.ipynb
 
     # Instructions: create a folder called "data-splits" containing "setfit-dataset-train.csv" and setfit-dataset-test.csv", which are generated from the Dataset Construction script
+    # (plus "setfit-dataset-classes.txt" for single-label splits, the class name of every class id, see single_label_classes())
     # Uncomment hyperparameter search code block and comment TrainingArguments code block and "args=args" to run a hyperparameter search
-    # Last, change the labels List in compute_metrics if running experiments with different labels than "Python and Coding", "GitHub", "Assignments", and "Time Management"
+    # The label names used in the metrics are taken from the splits (see Shared/label_schema.py)
+    # baseline.py trains only the classification head on the same splits, for a baseline without fine-tuning
 
     # Datasets are generated using the consensus data parser script
 
+    # the class name of every class id of single-label splits
+    class_path = "data-splits/setfit-dataset-classes.txt"
+
+    # where the time (and memory) of every phase of the run goes, see Shared/run_profiler.py
+    profiler = run_profiler.RunProfiler(script="SetFit", model="sentence-transformers/all-MiniLM-L12-v2")
+
     print("Loading datasets...")
-    # load two datasets from csv files in dataset dictionary
-    dataset = load_dataset('csv', data_files={
-        "train": "data-splits/setfit-dataset-train.csv",
-        "test": "data-splits/setfit-dataset-test.csv"
-    })
+    with profiler.phase("data load") as data_load:
+        # load two datasets from csv files (or their binary copies if they exist) in dataset dictionary
+        train_split = load_split("data-splits/setfit-dataset-train.csv", class_path)
+        test_split = load_split("data-splits/setfit-dataset-test.csv", class_path)
+        if train_split is not None and test_split is not None:
+            dataset = DatasetDict({"train": train_split, "test": test_split})
+        else:
+            dataset = load_dataset('csv', data_files={
+                "train": "data-splits/setfit-dataset-train.csv",
+                "test": "data-splits/setfit-dataset-test.csv"
+            })
+        data_load["examples"] = len(dataset["train"]) + len(dataset["test"])
 
     print("Processing datasets...")
     # extract the header column in the dataset
     labels = dataset["train"].column_names
-    if len(labels) > 2:  # len(labels) > 2 indicates a multi-label dataset
+    multi_label = len(labels) > 2  # len(labels) > 2 indicates a multi-label dataset
+    if multi_label:
         print("Multi-label dataset detected, doing preprocessing...")
         labels.remove("text")
 
@@ -154,7 +210,14 @@ def main():
         # on classifications made from a large set of reflections in a randomized order
         # no reflection from the test split will be in the train split, so over-fitting should not be a concern
 
-    # In the single label case, the data is already prepared for classification
+        metric_labels = [label_schema.display_name(label) for label in labels]
+    else:
+        # In the single label case, the data is already prepared for classification
+        # the label column holds class ids, so the names come from the file saved with the splits
+        metric_labels = single_label_classes(class_path)
+        # every class needs a name and every name a class, or the names end up on the wrong rows of the metrics
+        assert sorted(set(dataset["train"]["label"] + dataset["test"]["label"])) == list(range(len(metric_labels))), \
+            f"The class ids in the splits don't match the classes in {class_path}!"
 
     # tokenization as specified in the "Fine tuning BERT (and friends)" notebook is not necessary or worthwhile
     # (as far as I know) working with SetFit models. SetFit must tokenize the data behind the scene
@@ -170,13 +233,18 @@ def main():
 
     # fine tune pretrained model using datasets using default hyperparameters (will change as I run experiments with
     # varying hyperparameters, only running default hps for debugging right now)
-    trainer = Trainer(
-        model_init=model_init,
-        train_dataset=dataset["train"],
-        eval_dataset=dataset["test"],
-        metric=compute_metrics,
-        args=args
-    )
+    # model_init() is called (and the model loaded) when the Trainer is made
+    with profiler.phase("model load"):
+        trainer = Trainer(
+            model_init=model_init,
+            train_dataset=dataset["train"],
+            eval_dataset=dataset["test"],
+            metric=partial(compute_metrics, labels=metric_labels),
+            args=args
+        )
+    # SetFit generates its contrastive pairs in trainer.train() before the first epoch
+    epochs = run_profiler.epoch_callback(profiler, setup_phase="pair generation")
+    trainer.add_callback(epochs)
 
     print("Training...")
     """
@@ -191,10 +259,13 @@ def main():
     """
     # trainer.apply_hyperparameters(best_run.hyperparameters)
 
-    trainer.train()
+    with profiler.phase("training"):
+        epochs.mark()
+        trainer.train()
 
     print("Testing...")
-    metrics = trainer.evaluate()  # confusion data
+    with profiler.phase("evaluation", examples=len(dataset["test"])):
+        metrics = trainer.evaluate()  # confusion data
 
     # DON'T push to hub for initial pass of experiment
     # model.push_to_hub("setfit-multilabel-test")
@@ -208,7 +279,12 @@ def main():
             c_w.writerow(arr)
     print("Metrics data written to metrics.csv")
 
-    print(torch.cuda.memory_summary())
+    # save the trained model for CPU inference (see predict.py, which also checks it against the predictions above)
+    predict.export(trainer.model, "exported_model", metric_labels, multi_label=multi_label,
+                   test_path="data-splits/setfit-dataset-test.csv")
+
+    profiler.end()
+    print(f"Phase times written to {profiler.path}")
 
 
 if __name__ == "__main__":
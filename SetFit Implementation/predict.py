@@ -0,0 +1,97 @@
+# CPU inference for a trained SetFit model
+#
+# export() saves the model trained in main() of model.py (sentence transformer body + classification head) to a
+# directory, and Predictor loads it back onto the CPU, in fp32 or with the linear layers of the body dynamically
+# quantized to int8 (see Shared/cpu_inference.py), and classifies reflections in batches.
+# Running this script checks an exported model against the predictions trainer.evaluate() wrote
+# (raw_setfit_preds.csv for multi-label models, raw_results.csv for single-label ones) for the test split the
+# model was exported with (the fp32 and int8 predictions both have to agree with them within tolerance) and
+# writes the latency/throughput of both to inference_benchmark.csv
+#
+# Run from this directory after main() in model.py, which exports the model to exported_model/
+
+import csv
+import sys
+from pathlib import Path
+
+import numpy
+from setfit import SetFitModel
+
+# modules shared between every stage of the pipeline live in Shared/ at the top of the repository
+sys.path.append(str(Path(__file__).resolve().parent.parent / "Shared"))
+import cpu_inference
+
+
+# METHOD PARAMETERS
+# model: the trained SetFitModel (trainer.model)
+# path: directory to export to
+# labels: the labels compute_metrics() was given (see main() in model.py)
+# multi_label: whether the model was trained on a multi-label dataset
+# test_path: the test split the model was evaluated on
+def export(model, path, labels, multi_label, test_path):
+    model.save_pretrained(path)
+    cpu_inference.write_export_info(path, {"labels": list(labels), "multi_label": multi_label, "test_path": test_path})
+    print(f"Model exported to {path}")
+
+
+class Predictor:
+    # path: directory the model was exported to, quantized: quantize the body to int8 instead of keeping it fp32
+    def __init__(self, path, quantized=False, batch_size=64):
+        info = cpu_inference.read_export_info(path)
+        self.labels = info["labels"]
+        self.multi_label = info["multi_label"]
+        self.batch_size = batch_size
+        self.model = SetFitModel.from_pretrained(path, device="cpu")
+        if quantized:
+            self.model.model_body = cpu_inference.quantize(self.model.model_body)
+
+    # the model's predictions for every text, as a numpy array
+    # (sentence-transformers already sorts the reflections of every call by length before batching them and puts
+    # the embeddings back in order, so unlike FastFit's Predictor there's no length bucketing to do here)
+    def predict(self, texts):
+        return numpy.asarray(self.model.predict(list(texts), batch_size=self.batch_size, as_numpy=True))
+
+    # the predictions for every text as rows, the way compute_metrics() in model.py writes them: a 0/1 for
+    # every label for multi-label models, the label name for single-label ones
+    def predict_rows(self, texts):
+        predictions = self.predict(texts)
+        if self.multi_label:
+            return [[str(int(value)) for value in row] for row in predictions.tolist()]
+        if numpy.issubdtype(predictions.dtype, numpy.integer):
+            return [[self.labels[i]] for i in predictions.tolist()]
+        return [[str(label)] for label in predictions.tolist()]
+
+    # the labels predicted for every text by name: the label name for single-label models, the list of predicted
+    # label names for multi-label ones (see serve.py)
+    def predict_labels(self, texts):
+        rows = self.predict_rows(texts)
+        if self.multi_label:
+            return [[label for label, value in zip(self.labels, row) if value == "1"] for row in rows]
+        return [row[0] for row in rows]
+
+
+def main():
+    # where main() in model.py exported the model
+    export_path = "exported_model"
+    # largest fraction of predictions allowed to differ from what trainer.evaluate() predicted
+    tolerance = 0.02
+
+    info = cpu_inference.read_export_info(export_path)
+    with open(info["test_path"], "r", encoding="utf-8", newline="") as test:
+        texts = [row["text"] for row in csv.DictReader(test)]
+    reference = cpu_inference.read_raw_predictions("raw_setfit_preds.csv" if info["multi_label"] else "raw_results.csv")
+
+    timings = {}
+    predictions = {}
+    for variant, quantized in [("fp32", False), ("int8", True)]:
+        predictor = Predictor(export_path, quantized=quantized)
+        predictions[variant] = predictor.predict_rows(texts)
+        cpu_inference.compare(variant, predictions[variant], "trainer.evaluate()", reference, tolerance)
+        timings[variant] = cpu_inference.benchmark(predictor.predict, texts, predictor.batch_size)
+    cpu_inference.compare("int8", predictions["int8"], "fp32", predictions["fp32"], tolerance)
+
+    cpu_inference.write_benchmark("inference_benchmark.csv", timings)
+
+
+if __name__ == "__main__":
+    main()
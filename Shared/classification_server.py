@@ -0,0 +1,180 @@
+# Local classification server for trained reflection classifiers (see serve.py in the FastFit and SetFit
+# implementations, which load an exported model and start one of these)
+#
+# The model is loaded once and stays loaded. Requests are handled on their own threads, but they don't run the
+# model themselves: every request's reflections go on a queue, and one batching thread takes everything that
+# arrives within max_wait of the first queued request (up to max_batch_size reflections) and classifies it with a
+# single call to the model, then hands every request back its own labels. Under load batches fill up to
+# max_batch_size, and a lone request waits at most max_wait for company.
+#
+# API (JSON over HTTP, on a TCP port or a Unix socket):
+#   POST /classify  {"texts": ["reflection", ...]} (or {"text": "reflection"}) -> {"labels": [label, ...]}
+#                   in the same order, with the label names compute_metrics() uses
+#   GET  /health    -> {"status": "ok", "requests", "reflections", "batches", "mean_batch_size"}
+
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# A request waiting for its labels
+class _Pending:
+    def __init__(self, texts):
+        self.texts = texts
+        self.labels = None
+        self.error = None
+        self.done = threading.Event()
+
+
+# METHOD PARAMETERS
+# classify: function that takes a list of reflections and returns the label(s) of each
+# max_batch_size: most reflections classified in one call of classify (a single bigger request is still
+#   classified in one go)
+# max_wait: seconds a batch waits for more requests after its first one arrives
+class MicroBatcher:
+    def __init__(self, classify, max_batch_size=64, max_wait=0.01):
+        self.classify = classify
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.stats = {"requests": 0, "reflections": 0, "batches": 0}
+        self._lock = threading.Lock()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    # labels of every text in texts, blocks until the batch they end up in has been classified
+    def submit(self, texts):
+        pending = _Pending(list(texts))
+        if not pending.texts:
+            return []
+        self.queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.labels
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            size = len(batch[0].texts)
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(pending)
+                size += len(pending.texts)
+            self._classify(batch, size)
+
+    def _classify(self, batch, size):
+        try:
+            labels = list(self.classify([text for pending in batch for text in pending.texts]))
+            assert len(labels) == size, f"Got {len(labels)} predictions for {size} reflections!"
+            start = 0
+            for pending in batch:
+                pending.labels = labels[start:start + len(pending.texts)]
+                start += len(pending.texts)
+        except Exception as e:
+            for pending in batch:
+                pending.error = e
+        with self._lock:
+            self.stats["requests"] += len(batch)
+            self.stats["reflections"] += size
+            self.stats["batches"] += 1
+        for pending in batch:
+            pending.done.set()
+
+    def health(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats["mean_batch_size"] = stats["reflections"] / stats["batches"] if stats["batches"] else 0.0
+        return dict(status="ok", **stats)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    batcher = None  # set in serve()
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/health":
+            return self._reply(404, {"error": f"Unknown path {self.path}"})
+        self._reply(200, self.batcher.health())
+
+    def do_POST(self):
+        if self.path != "/classify":
+            return self._reply(404, {"error": f"Unknown path {self.path}"})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not isinstance(body, dict):
+                raise ValueError("The body has to be a json object")
+            texts = body["texts"] if "texts" in body else [body["text"]]
+            # a string is iterable too, {"texts": "..."} would otherwise be classified one character at a time
+            if not isinstance(texts, list) or not texts:
+                raise ValueError("\"texts\" has to be a non-empty list")
+            if not all(isinstance(text, str) for text in texts):
+                raise ValueError("Every reflection has to be a string")
+        except (ValueError, KeyError, TypeError) as e:
+            return self._reply(400, {"error": f"Expected {{\"texts\": [...]}} or {{\"text\": \"...\"}}: {e!r}"})
+        try:
+            labels = self.batcher.submit(texts)
+        except Exception as e:
+            return self._reply(500, {"error": repr(e)})
+        self._reply(200, {"labels": labels})
+
+    # client_address is just a path on a Unix socket
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 resets connections as soon as a handful of clients connect at once
+    request_queue_size = 128
+
+
+class _UnixHTTPServer(_Server):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        self.socket.bind(self.server_address)
+        self.server_name, self.server_port = "localhost", 0
+
+
+# METHOD PARAMETERS
+# classify: see MicroBatcher
+# host, port: where to listen over TCP (only bind to localhost unless the machine is behind a firewall, there's no
+#   authentication)
+# unix_socket: path of a Unix socket to listen on instead of host/port
+# max_batch_size, max_wait: see MicroBatcher
+def serve(classify, host="127.0.0.1", port=8000, unix_socket=None, max_batch_size=64, max_wait=0.01):
+    handler = type("Handler", (_Handler,), {"batcher": MicroBatcher(classify, max_batch_size, max_wait)})
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = _UnixHTTPServer(unix_socket, handler)
+        print(f"Serving on unix socket {unix_socket}")
+    else:
+        server = _Server((host, port), handler)
+        print(f"Serving on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix_socket is not None and os.path.exists(unix_socket):
+            os.remove(unix_socket)
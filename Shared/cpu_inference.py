@@ -0,0 +1,96 @@
+# CPU inference helpers shared by the FastFit and SetFit predictors (predict.py in both implementations)
+#
+# A trained model is exported once (see export() in predict.py), and loaded back onto the CPU either as is
+# (fp32) or with every nn.Linear dynamically quantized to int8, which is where almost all of the time of
+# a transformer encoder goes. Predictions are made in batches, and compare()/benchmark() check the int8
+# predictions against the fp32 ones (and the predictions trainer.evaluate() wrote) and time both
+
+import csv
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+EXPORT_INFO = "export.json"  # what predict.py needs to know about an exported model, next to its weights
+
+
+# module with every nn.Linear replaced by a dynamically quantized int8 one (weights are quantized once,
+# activations on the fly)
+def quantize(module):
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def batches(items, batch_size):
+    for i in range(0, len(items), batch_size):
+        yield items[i:i + batch_size]
+
+
+# Batches of positions of inputs with the given lengths (e.g. token counts), grouped by length: the positions are
+# sorted by length (stably, so inputs of the same length stay in order) and cut into batches of batch_size, so every
+# batch is only padded up to the longest input in it instead of having one-word reflections padded to the length
+# of paragraphs. Results computed batch by batch are put back in the original order with out[batch] = result
+def length_batches(lengths, batch_size):
+    order = np.argsort(np.asarray(lengths, dtype=np.int64), kind="stable")
+    return list(batches(order, batch_size))
+
+
+def write_export_info(path, info):
+    with open(os.path.join(path, EXPORT_INFO), "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+
+
+def read_export_info(path):
+    with open(os.path.join(path, EXPORT_INFO), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# Rows of a raw predictions csv written by compute_metrics() (one prediction per row)
+def read_raw_predictions(path):
+    with open(path, "r", encoding="utf-8", newline="") as raw:
+        return [row for row in csv.reader(raw)]
+
+
+# METHOD PARAMETERS
+# predictions, reference: rows of predictions (lists of strings, the same way compute_metrics() writes them)
+# tolerance: largest fraction of rows allowed to differ
+# RETURNS the fraction of rows that are the same
+def compare(name, predictions, reference_name, reference, tolerance):
+    assert len(predictions) == len(reference), f"{name} has {len(predictions)} predictions, {reference_name} has {len(reference)}!"
+    agreement = float(np.mean([list(a) == list(b) for a, b in zip(predictions, reference)])) if reference else 1.0
+    print(f"{name} agrees with {reference_name} on {agreement:.2%} of predictions")
+    assert 1 - agreement <= tolerance, f"{name} differs from {reference_name} on more than {tolerance:.2%} of predictions!"
+    return agreement
+
+
+# Time predict(texts) after one warm up batch, best of repeats
+# RETURNS {"seconds", "reflections_per_second", "ms_per_reflection"}
+def benchmark(predict, texts, batch_size, repeats=3):
+    predict(texts[:batch_size])
+    seconds = min(_timed(predict, texts) for _ in range(repeats))
+    return {
+        "seconds": seconds,
+        "reflections_per_second": len(texts) / seconds,
+        "ms_per_reflection": 1000 * seconds / len(texts),
+    }
+
+
+def _timed(predict, texts):
+    start = time.perf_counter()
+    predict(texts)
+    return time.perf_counter() - start
+
+
+# Print and write the benchmark() results of every variant, with the speedup over the first one
+def write_benchmark(path, timings):
+    base = next(iter(timings.values()))["seconds"]
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        c_w = csv.writer(f)
+        c_w.writerow(["variant", "seconds", "reflections_per_second", "ms_per_reflection", "speedup"])
+        for variant, timing in timings.items():
+            speedup = base / timing["seconds"]
+            c_w.writerow([variant, timing["seconds"], timing["reflections_per_second"], timing["ms_per_reflection"], speedup])
+            print(f"{variant}: {timing['ms_per_reflection']:.2f} ms per reflection, "
+                  f"{timing['reflections_per_second']:.1f} reflections/s, {speedup:.2f}x")
+    print(f"Benchmark written to {path}")
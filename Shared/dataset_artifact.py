@@ -0,0 +1,111 @@
+# Binary, memory-mappable copy of a multi-label dataset csv (full_dataset.csv, low_disagreement_dataset.csv, ...)
+# Every stage after Dataset Construction used to re-parse the same wide label matrix out of csv text.
+# The artifact is a directory named after the csv (e.g. full_dataset.csv -> full_dataset/) containing:
+#   header.json -> {"version", "labels": [label column names], "num_reflections", "single_label"}
+#   labels.npy  -> int8 (num_reflections x num_labels) label matrix, opened with mmap so nothing is copied
+#   text.bin    -> every reflection's utf-8 bytes back to back
+#   offsets.npy -> int64 offsets into text.bin, reflection i is text.bin[offsets[i]:offsets[i+1]]
+# The csv is still written as well, since that's what people look at and what the older scripts expect
+# An existing multi-label csv can be converted with: python dataset_artifact.py <file.csv>
+
+import csv
+import json
+import os
+import sys
+
+import numpy as np
+
+ARTIFACT_VERSION = 1
+
+
+# "full_dataset.csv" -> "full_dataset"
+def artifact_path(csv_path):
+    return os.path.splitext(csv_path)[0]
+
+
+# METHOD PARAMETERS
+# path: directory to write the artifact to (see artifact_path())
+# matrix: (num_reflections x num_labels) array of 0/1 labels
+# texts: list of reflections, one per row of matrix
+# labels: label column names, in column order
+# single_label: whether every row has exactly one label (i.e. the csv is a (text, label) dataset)
+def write_artifact(path, matrix, texts, labels, single_label=False):
+    matrix = np.asarray(matrix, dtype=np.int8)
+    assert len(matrix) == len(texts), "Label matrix and reflections have different lengths!"
+    os.makedirs(path, exist_ok=True)
+
+    encoded = [text.encode("utf-8") for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(text) for text in encoded])
+
+    np.save(f"{path}/labels.npy", matrix.reshape(len(texts), len(labels)))
+    np.save(f"{path}/offsets.npy", offsets)
+    with open(f"{path}/text.bin", "wb") as t:
+        t.write(b"".join(encoded))
+    # header is written last, an artifact without one is incomplete and won't be opened
+    with open(f"{path}/header.json", "w", encoding="utf-8") as h:
+        json.dump({"version": ARTIFACT_VERSION, "labels": list(labels), "num_reflections": len(texts),
+                   "single_label": single_label}, h)
+
+
+# Read-only view of an artifact written by write_artifact(). matrix and the text blob are memory-mapped,
+# so opening one is instant and only the rows/reflections actually used are read from disk
+class DatasetArtifact:
+    def __init__(self, path):
+        with open(f"{path}/header.json", "r", encoding="utf-8") as h:
+            header = json.load(h)
+        assert header["version"] == ARTIFACT_VERSION, f"{path} was written by a different artifact version"
+        self.labels = header["labels"]
+        self.single_label = header["single_label"]
+        self.matrix = np.load(f"{path}/labels.npy", mmap_mode="r")
+        self.offsets = np.load(f"{path}/offsets.npy", mmap_mode="r")
+        # np.memmap can't map an empty file
+        size = os.path.getsize(f"{path}/text.bin")
+        self.blob = np.memmap(f"{path}/text.bin", dtype=np.uint8, mode="r") if size else np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def text(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i+1]].tobytes().decode("utf-8")
+
+    def texts(self):
+        data = self.blob.tobytes()
+        offsets = self.offsets.tolist()
+        return [data[offsets[i]:offsets[i+1]].decode("utf-8") for i in range(0, len(self))]
+
+    # label name of every row for single-label datasets, i.e. the column of the first 1 in each row
+    def single_labels(self):
+        return [self.labels[i] for i in np.argmax(self.matrix, axis=1).tolist()]
+
+
+# Open the artifact belonging to csv_path, or return None if there isn't one (or if the csv has been
+# modified since the artifact was written, in which case the csv is the source of truth)
+def open_artifact(csv_path):
+    path = artifact_path(csv_path)
+    header = f"{path}/header.json"
+    if not os.path.exists(header):
+        return None
+    if os.path.exists(csv_path) and os.path.getmtime(csv_path) > os.path.getmtime(header):
+        return None
+    return DatasetArtifact(path)
+
+
+# Returns (labels, matrix, texts) for a multi-label dataset csv (label columns followed by a "text" column),
+# from its artifact if there is one, otherwise parsed from the csv itself
+def read_dataset(csv_path):
+    artifact = open_artifact(csv_path)
+    if artifact is not None:
+        return artifact.labels, artifact.matrix, artifact.texts()
+    with open(csv_path, "r", encoding="utf-8") as f:
+        c_r = list(csv.reader(f))
+    labels = c_r[0][:-1]
+    matrix = np.array([row[:-1] for row in c_r[1:]], dtype=np.int8).reshape(len(c_r) - 1, len(labels))
+    return labels, matrix, [row[-1] for row in c_r[1:]]
+
+
+if __name__ == "__main__":
+    for csv_file in sys.argv[1:]:
+        labels, matrix, texts = read_dataset(csv_file)
+        write_artifact(artifact_path(csv_file), matrix, texts, labels)
+        print(f"Wrote {artifact_path(csv_file)}/ ({len(texts)} reflections, {len(labels)} labels)")
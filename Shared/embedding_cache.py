@@ -0,0 +1,156 @@
+# Persistent cache of sentence embeddings
+#
+# Anything that runs the base sentence transformer without fine-tuning it (head-only/baseline experiments, see
+# SetFit Implementation/baseline.py) gets the same embedding for the same reflection every time, so the
+# embeddings are kept on disk, shared between every experiment and both implementations, instead of being
+# recomputed on every run. A cache is a directory per (model name, max length) in embedding_cache/ at the top of
+# the repository containing:
+#   header.json    -> {"version", "model", "max_length", "dim", "rows"}
+#   embeddings.f16 -> float16 (rows x dim) embedding matrix, opened with np.memmap
+#   digests.bin    -> 16 byte digest of the reflection of every row (see reflection_store.digest()), the id index
+# Rows are only ever appended, and the header is written last: anything in the two files past header["rows"] is
+# left over from an append that didn't finish and is overwritten by the next one.
+# Appends take a file lock (on systems with fcntl), so parallel trials can share a cache
+
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+import reflection_store
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+CACHE_VERSION = 1
+EMBEDDING_CACHE = str(Path(__file__).resolve().parent.parent / "embedding_cache")
+DIGEST_SIZE = 16
+
+
+def cache_path(model_name, max_length, root=EMBEDDING_CACHE):
+    return os.path.join(root, f"{model_name.replace('/', '_')}-len{max_length}")
+
+
+# METHOD PARAMETERS
+# model_name: the sentence transformer the embeddings are made with
+# max_length: the max sequence length reflections are truncated to before they're embedded
+# root: the directory the caches of every model live in
+class EmbeddingCache:
+    def __init__(self, model_name, max_length, root=EMBEDDING_CACHE):
+        self.model_name = model_name
+        self.max_length = max_length
+        self.path = cache_path(model_name, max_length, root)
+        os.makedirs(self.path, exist_ok=True)
+        self._load()
+
+    def __len__(self):
+        return self.rows
+
+    # (re)read the header and the index, e.g. after another process appended to the cache
+    def _load(self):
+        header = os.path.join(self.path, "header.json")
+        if os.path.exists(header):
+            with open(header, "r", encoding="utf-8") as h:
+                header = json.load(h)
+            assert header["version"] == CACHE_VERSION, f"{self.path} was written by a different cache version"
+            self.rows, self.dim = header["rows"], header["dim"]
+        else:
+            self.rows, self.dim = 0, None
+
+        digests = np.fromfile(os.path.join(self.path, "digests.bin"), dtype=np.uint8, count=self.rows * DIGEST_SIZE) \
+            if self.rows else np.zeros(0, dtype=np.uint8)
+        self._ids = {key.tobytes(): i for i, key in enumerate(digests.reshape(self.rows, DIGEST_SIZE))}
+        # np.memmap can't map an empty file
+        self.matrix = np.memmap(os.path.join(self.path, "embeddings.f16"), dtype=np.float16, mode="r",
+                                shape=(self.rows, self.dim)) if self.rows else np.zeros((0, self.dim or 0), dtype=np.float16)
+
+    @contextmanager
+    def _locked(self):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.path, "lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # rows of every text in texts, -1 for texts that aren't in the cache
+    def lookup(self, texts):
+        return np.fromiter((self._ids.get(reflection_store.digest(text), -1) for text in texts), dtype=np.int64,
+                           count=len(texts))
+
+    # METHOD PARAMETERS
+    # texts: reflections to get the embeddings of
+    # encode: function that embeds a list of reflections into a (len(list) x dim) array (see
+    #   sentence_transformer_encoder()), called only for reflections that aren't cached yet. None to only read
+    #   from the cache, in which case a missing reflection is a KeyError
+    # batch_size: how many reflections are passed to encode at once
+    # RETURNS the (len(texts) x dim) float16 embeddings of texts
+    def embeddings(self, texts, encode=None, batch_size=256):
+        texts = list(texts)
+        rows = self.lookup(texts)
+        if np.any(rows < 0):
+            if encode is None:
+                raise KeyError(f"{int(np.sum(rows < 0))} reflection(s) aren't in {self.path}")
+            with self._locked():
+                self._load()
+                rows = self.lookup(texts)
+                # every distinct missing reflection once, in order of first appearance
+                missing = list(dict.fromkeys(text for text, row in zip(texts, rows.tolist()) if row < 0))
+                for start in range(0, len(missing), batch_size):
+                    batch = missing[start:start + batch_size]
+                    self._append(batch, np.asarray(encode(batch), dtype=np.float32))
+                rows = self.lookup(texts)
+        return np.asarray(self.matrix[rows])
+
+    def _append(self, texts, vectors):
+        assert vectors.shape == (len(texts), vectors.shape[1]), "Expected one embedding per reflection!"
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        assert vectors.shape[1] == self.dim, f"Embeddings have dimension {vectors.shape[1]}, cache has {self.dim}!"
+
+        self.matrix = None  # release the mapping before the files under it are written
+        digests = b"".join(reflection_store.digest(text) for text in texts)
+        for name, data, row_size in [("embeddings.f16", vectors.astype(np.float16).tobytes(), self.dim * 2),
+                                     ("digests.bin", digests, DIGEST_SIZE)]:
+            path = os.path.join(self.path, name)
+            with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                f.seek(self.rows * row_size)
+                f.write(data)
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+
+        header = os.path.join(self.path, "header.json")
+        with open(f"{header}.tmp", "w", encoding="utf-8") as h:
+            json.dump({"version": CACHE_VERSION, "model": self.model_name, "max_length": self.max_length,
+                       "dim": self.dim, "rows": self.rows + len(texts)}, h)
+        os.replace(f"{header}.tmp", header)
+        self._load()
+
+
+# encode function for EmbeddingCache.embeddings() that embeds with the sentence transformer model_name, truncated
+# to max_length. The model is only loaded the first time something actually has to be embedded
+def sentence_transformer_encoder(model_name, max_length, device=None, batch_size=64):
+    model = None
+
+    def encode(texts):
+        nonlocal model
+        if model is None:
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(model_name, device=device)
+            model.max_seq_length = max_length
+        return model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+    return encode
+
+
+# The embeddings of texts made with the sentence transformer model_name, from the cache where possible
+def embed(texts, model_name, max_length, device=None):
+    cache = EmbeddingCache(model_name, max_length)
+    return cache.embeddings(texts, encode=sentence_transformer_encoder(model_name, max_length, device=device))
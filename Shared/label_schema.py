@@ -0,0 +1,142 @@
+# The label schema shared by every stage of the pipeline
+#
+# Every label the annotators have used, the spellings that map onto them (aliases and the label names
+# used by the D-ESA4-1 dropdowns), and which labels are kept in the final datasets all live here.
+# LabelSchema compiles that into:
+#   labels        -> the kept labels in column order (the label columns of full_dataset.csv)
+#   issue2integer -> every accepted spelling of a kept label -> its column
+#   integer2issue -> column -> label name
+#   remap         -> dense int array, superset label id -> column (excluded labels -> excluded_id)
+# encode()/decode() then convert whole label columns at once: every distinct label name is looked up
+# once, and the rest is numpy indexing
+
+import numpy as np
+
+# Superset of labels as of 1/28, in column order. Labels excluded from a dataset keep their spot here,
+# the columns of the remaining labels are just renumbered to be consecutive
+SUPERSET = [
+    "None",
+    "Python and Coding",
+    "Github",
+    "MySQL",
+    "Assignments",
+    "Quizzes",
+    "Understanding requirements and instructions",
+    "Learning New Material",
+    "Course Structure and Materials",
+    "Time Management and Motivation",
+    "Group Work",
+    "IDE and Package Installation",
+    "API",
+    "Personal Issue",
+    "HTML",
+    "SDLC",
+]
+
+# a lot of people put "FastAPI" instead of "API" as their label for issues with fastapi,
+# so "FastAPI" gets the same column as "API" (and maps back to just "API")
+ALIASES = {
+    "FastAPI": "API",
+}
+
+# label names used by the dropdowns of the new (D-ESA4-1) annotation formatting
+RAW_LABEL_NAMES = {
+    "python_and_coding": "Python and Coding",
+    "SDLC": "SDLC",
+    "github": "Github",
+    "mysql": "MySQL",
+    "api": "API",
+    "html": "HTML",
+    "ide_package_software_installation": "IDE and Package Installation",
+    "ide_and_environment_setup": "IDE and Package Installation",
+    "course_structure_and_materials": "Course Structure and Materials",
+    "understanding_requirements_and_instructions": "Understanding requirements and instructions",
+    "time_management_and_motivation": "Time Management and Motivation",
+    "group_work": "Group Work",
+    "none": "None",
+}
+
+# the name a label is given once it's in a model's hands: FastFit internally treats the string
+# label "None" as None (as in the null value), so it becomes "No Issue"
+DISPLAY_NAMES = {
+    "None": "No Issue",
+}
+
+
+# Label given to reflections with an issue outside of the superset, depending on the label category
+def other_label(label_category):
+    return "Other Primary" if label_category == "Primary" else "Other Secondary"
+
+
+# Mapping from D-ESA4-1 dropdown label names to label names, for label_category
+def raw_label_names(label_category):
+    return dict(RAW_LABEL_NAMES, other=other_label(label_category))
+
+
+# Check that every label in names is in the superset (or an alias of one) and return them with the
+# aliases resolved, e.g. for picking the labels an experiment uses
+def canonical(names):
+    names = [ALIASES.get(name, name) for name in names]
+    unknown = [name for name in names if name not in SUPERSET]
+    if unknown:
+        raise KeyError(f"Unknown label(s) {unknown}, see SUPERSET in Shared/label_schema.py")
+    return names
+
+
+def display_name(label):
+    return DISPLAY_NAMES.get(label, label)
+
+
+# Names of the classes of a single-label dataset in the order models number them (sorted by the
+# name the model sees), e.g. for turning predicted class ids back into label names
+def class_names(labels):
+    return sorted({display_name(label) for label in labels})
+
+
+# METHOD PARAMETERS
+# exclude_labels: labels from SUPERSET to leave out of the dataset
+# label_category: "Primary" or "Secondary", decides which "Other" label is appended as the last column
+class LabelSchema:
+    def __init__(self, exclude_labels=(), label_category="Primary"):
+        self.exclude_labels = canonical(exclude_labels)
+        self.label_category = label_category
+
+        kept = [label for label in SUPERSET if label not in self.exclude_labels]
+        self.labels = kept + [other_label(label_category)]
+        self.excluded_id = len(self.labels)  # encode() gives every label that isn't kept this id
+
+        self.integer2issue = dict(enumerate(self.labels))
+        self.issue2integer = {label: i for i, label in enumerate(self.labels)}
+        for alias, label in ALIASES.items():
+            if label in self.issue2integer:
+                self.issue2integer[alias] = self.issue2integer[label]
+
+        # superset label id -> column, where the "Other" label is superset id len(SUPERSET) and
+        # the last entry is for anything that isn't a label at all
+        self.superset_ids = {label: i for i, label in enumerate(SUPERSET + [other_label(label_category)])}
+        self.superset_ids.update({alias: self.superset_ids[label] for alias, label in ALIASES.items()})
+        self.remap = np.full(len(SUPERSET) + 2, self.excluded_id, dtype=np.int64)
+        for label, i in self.superset_ids.items():
+            self.remap[i] = self.issue2integer.get(label, self.excluded_id)
+
+    def __len__(self):
+        return len(self.labels)
+
+    # Column of every label name in names as an int64 array, excluded_id for excluded or unknown labels
+    def encode(self, names):
+        names = np.asarray(names, dtype=object)
+        if len(names) == 0:
+            return np.zeros(0, dtype=np.int64)
+        distinct, inverse = np.unique(names, return_inverse=True)
+        unknown = len(self.remap) - 1
+        ids = np.array([self.superset_ids.get(name, unknown) for name in distinct], dtype=np.int64)
+        return self.remap[ids][inverse.reshape(-1)]
+
+    # Label name of every column id in ids
+    def decode(self, ids):
+        return np.asarray(self.labels, dtype=object)[np.asarray(ids, dtype=np.int64)]
+
+    # Everything the encoded labels depend on, as plain json-able data (e.g. to tell if a cached
+    # result was made with the same labels)
+    def config(self):
+        return {"labels": self.labels, "issue2integer": self.issue2integer, "label_category": self.label_category}
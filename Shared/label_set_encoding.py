@@ -0,0 +1,126 @@
+# Reading and writing label_sets.csv, the per-annotator label sets of every reflection
+# (used by the Dataset Filtering stage to calculate agreement, and by validate_datasets())
+#
+# label_sets.csv used to store each reflection's label sets as the Python repr of a list of lists,
+# which every reader had to eval() (several times per row in some places). Now each label set is stored
+# as an integer bitmask over the label vocabulary, next to the id of the annotator it came from:
+#   header row: text, annotators, label_masks, <label 0>, <label 1>, ...
+#   every other row: reflection text, space separated annotator ids, space separated label masks
+# where bit i of a label mask means that annotator gave the reflection labels[i]
+# e.g. with labels [None, Python and Coding, Github], the label sets [[Github], [None, Github]] from
+# annotators 0 and 2 are written as: text,0 2,4 5
+#
+# read_label_sets() parses the whole file once into flat numpy arrays. Old style label_sets.csv files
+# are still readable (with ast.literal_eval instead of eval)
+
+import ast
+import csv
+
+import numpy as np
+
+HEADER = ["text", "annotators", "label_masks"]
+
+
+# METHOD PARAMETERS
+# path: csv file to write
+# rows: list of (reflection text, [annotator ids], [label masks]) for every reflection
+# labels: label vocabulary, bit i of a mask is labels[i]
+def write_label_sets(path, rows, labels):
+    with open(path, "w", encoding="utf-8", newline="") as l_s:
+        c_w = csv.writer(l_s)
+        c_w.writerow(HEADER + list(labels))
+        for text, annotators, masks in rows:
+            c_w.writerow([text, " ".join(str(a) for a in annotators), " ".join(str(m) for m in masks)])
+
+
+# Encode a list of label sets (lists of label names) as bitmasks over labels
+def encode_masks(label_sets, labels):
+    bit = {label: 1 << i for i, label in enumerate(labels)}
+    return [sum(bit[label] for label in set(l_set)) for l_set in label_sets]
+
+
+# Number of labels in each label mask of masks (an integer array)
+def popcount(masks):
+    masks = np.ascontiguousarray(masks, dtype=">u8")
+    bits = np.unpackbits(masks.view(np.uint8).reshape(masks.shape + (8,)), axis=-1)
+    return bits.sum(axis=-1, dtype=np.int64)
+
+
+# Every reflection's label sets, parsed once into flat arrays
+# texts: reflection texts
+# labels: label vocabulary (bit i of a mask is labels[i])
+# offsets: the label sets of reflection i are entries offsets[i]:offsets[i+1] of annotators and masks
+# annotators: annotator id of each label set
+# masks: label bitmask of each label set
+class LabelSets:
+    def __init__(self, texts, labels, offsets, annotators, masks):
+        self.texts = texts
+        self.labels = labels
+        self.offsets = offsets
+        self.annotators = annotators
+        self.masks = masks
+
+    def __len__(self):
+        return len(self.texts)
+
+    # number of label sets (annotators) for every reflection
+    def num_sets(self):
+        return np.diff(self.offsets)
+
+    # (num label sets x num labels) 0/1 matrix, one row per label set
+    def bit_matrix(self):
+        return ((self.masks[:, None] >> np.arange(len(self.labels), dtype=np.int64)) & 1).astype(np.int8)
+
+    # number of labels in every label set
+    def set_sizes(self):
+        return popcount(self.masks)
+
+    # mean label set length of every reflection
+    def mean_set_sizes(self):
+        owners = np.repeat(np.arange(len(self)), self.num_sets())
+        totals = np.bincount(owners, weights=self.set_sizes(), minlength=len(self))
+        return totals / np.maximum(self.num_sets(), 1)
+
+    # the label sets of reflection i as a list of sets of label names
+    def label_sets(self, i):
+        return [self.decode(mask) for mask in self.masks[self.offsets[i]:self.offsets[i+1]].tolist()]
+
+    def decode(self, mask):
+        return {label for j, label in enumerate(self.labels) if mask >> j & 1}
+
+    # new LabelSets with only the reflections at the given positions (in that order)
+    def subset(self, positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        starts, ends = self.offsets[positions], self.offsets[positions + 1]
+        lengths = ends - starts
+        offsets = np.zeros(len(positions) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+        entries = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return LabelSets([self.texts[p] for p in positions.tolist()], self.labels, offsets,
+                         self.annotators[entries], self.masks[entries])
+
+
+# Parse label_sets.csv (either format) into a LabelSets
+def read_label_sets(path):
+    with open(path, "r", encoding="utf-8") as l_s:
+        c_r = list(csv.reader(l_s))
+
+    if c_r and c_r[0][:len(HEADER)] == HEADER:
+        labels = c_r[0][len(HEADER):]
+        rows = c_r[1:]
+        texts = [row[0] for row in rows]
+        annotators = [row[1].split() for row in rows]
+        masks = [row[2].split() for row in rows]
+    else:
+        # old style label_sets.csv, the label vocabulary is every label that shows up in the file
+        texts = [row[0] for row in c_r]
+        sets = [ast.literal_eval(row[1]) for row in c_r]
+        labels = sorted({label for l_sets in sets for l_set in l_sets for label in l_set})
+        annotators = [list(range(0, len(l_sets))) for l_sets in sets]
+        masks = [encode_masks(l_sets, labels) for l_sets in sets]
+
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(m) for m in masks])
+    annotators = np.array([a for row in annotators for a in row], dtype=np.int32)
+    masks = np.array([m for row in masks for m in row], dtype=np.int64)
+    return LabelSets(texts, labels, offsets, annotators, masks)
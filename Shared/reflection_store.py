@@ -0,0 +1,52 @@
+# Interned reflection texts
+#
+# The same reflections get passed around (and compared, and used as dict keys) in every stage of the pipeline.
+# A ReflectionStore keeps one copy of each distinct reflection and gives it a stable integer id, in order of
+# first appearance, so that everything else (joins, membership tests, which reflections to keep) can be done with
+# ids (or numpy arrays of ids) instead of with the full text.
+# The id index is a dict keyed by the texts themselves: it holds references to the strs in texts rather than
+# copies, and str caches its hash, so a lookup is one hash of the text at most. digest() is for keys that have
+# to outlive the process (see Shared/embedding_cache.py)
+
+import hashlib
+
+import numpy as np
+
+
+# 16 byte blake2b digest of a reflection's utf-8 text
+def digest(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class ReflectionStore:
+    def __init__(self, texts=()):
+        self.texts = []  # id -> text
+        self._ids = {}  # text -> id
+        self.intern_all(texts)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __contains__(self, text):
+        return text in self._ids
+
+    # id of text, added to the store if it isn't in there yet
+    def intern(self, text):
+        i = self._ids.get(text)
+        if i is None:
+            i = len(self.texts)
+            self._ids[text] = i
+            self.texts.append(text)
+        return i
+
+    # ids of every text in texts as an int64 array (see intern())
+    def intern_all(self, texts):
+        return np.fromiter((self.intern(text) for text in texts), dtype=np.int64)
+
+    # ids of every text in texts without adding anything, -1 for texts that aren't in the store
+    def lookup(self, texts):
+        return np.fromiter((self._ids.get(text, -1) for text in texts), dtype=np.int64)
+
+    # texts of every id in ids
+    def get(self, ids):
+        return [self.texts[i] for i in np.asarray(ids, dtype=np.int64).tolist()]
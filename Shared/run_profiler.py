@@ -0,0 +1,132 @@
+# Structured timing/memory log for training and inference runs
+#
+# A RunProfiler appends one JSON object per line to a run log (run_log.jsonl by default), every line tagged with
+# the id of the run it belongs to, so several runs can share a log and the Results script can group them back up
+# (see read_run_logs() in Results + Visualization Code/main.py). Lines have an "event":
+#   "start" -> the context the run was started with (model, shot, ...), the torch thread settings, CPU count and
+#              whether CUDA is available
+#   "phase" -> one timed phase (data load, model load, pair generation, training, epoch, evaluation, ...): wall
+#              time, examples and examples per second if the phase was given a number of examples, and the peak
+#              RSS (and peak CUDA memory on a GPU) of the process so far
+#   "end"   -> total wall time and peak memory of the run
+# Training epochs are timed with epoch_callback(), a transformers TrainerCallback. Its phases happen inside
+# trainer.train(), so they're tagged with "within": "training" (their time is already part of the training phase)
+
+import json
+import os
+import platform
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+RUN_LOG = "run_log.jsonl"
+
+
+# Peak resident set size of this process so far in MB, None where the resource module doesn't exist
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+
+def torch_settings():
+    settings = {"cpu_count": os.cpu_count()}
+    settings.update({var: os.environ.get(var) for var in ["OMP_NUM_THREADS", "MKL_NUM_THREADS"]})
+    if torch is not None:
+        settings.update({
+            "torch_version": torch.__version__,
+            "torch_num_threads": torch.get_num_threads(),
+            "torch_num_interop_threads": torch.get_num_interop_threads(),
+            "cuda_available": torch.cuda.is_available(),
+        })
+    return settings
+
+
+# METHOD PARAMETERS
+# path: the run log to append to
+# context: anything that identifies the run (script, model name, shot, seed, ...), written with the start event
+class RunProfiler:
+    def __init__(self, path=RUN_LOG, **context):
+        self.path = path
+        self.run = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.start = time.perf_counter()
+        self.record("start", **context, **torch_settings())
+
+    def record(self, event, **fields):
+        line = {"run": self.run, "event": event, "time": datetime.now().isoformat(timespec="seconds"), **fields}
+        with open(self.path, "a", encoding="utf-8") as log:
+            log.write(json.dumps(line) + "\n")
+        return line
+
+    def _memory(self):
+        memory = {"peak_rss_mb": peak_rss_mb()}
+        if torch is not None and torch.cuda.is_available():
+            memory["peak_cuda_mb"] = torch.cuda.max_memory_allocated() / (1024 * 1024)
+        return memory
+
+    # Record a phase that took seconds to process examples (if given)
+    def record_phase(self, name, seconds, examples=None, **fields):
+        phase = {"phase": name, "seconds": seconds, **fields}
+        if examples is not None:
+            phase["examples"] = examples
+            phase["examples_per_second"] = examples / seconds if seconds > 0 else None
+        return self.record("phase", **phase, **self._memory())
+
+    # Time the body of a with block as the phase name. Yields a dict that holds the phase's record once the block
+    # is done (e.g. to read its "seconds"), examples can also be set in it from inside the block if the number of
+    # examples isn't known beforehand
+    @contextmanager
+    def phase(self, name, examples=None, **fields):
+        result = {"examples": examples}
+        start = time.perf_counter()
+        yield result
+        result.update(self.record_phase(name, time.perf_counter() - start, **dict(fields, examples=result["examples"])))
+
+    def end(self, **fields):
+        return self.record("end", seconds=time.perf_counter() - self.start, **fields, **self._memory())
+
+
+# transformers TrainerCallback that records every training epoch as an "epoch" phase (with the examples it trained
+# on, from the steps taken and the batch size), and the time from the start of trainer.train() to the first step
+# as setup_phase (e.g. SetFit builds its contrastive pairs in there)
+def epoch_callback(profiler, setup_phase="training setup"):
+    from transformers import TrainerCallback
+
+    class EpochCallback(TrainerCallback):
+        def __init__(self):
+            self.created = time.perf_counter()
+            self.epoch_start = None
+            self.epoch_step = 0
+
+        # trainers are usually built right before train() is called, so setup is timed from when the callback
+        # was made, unless mark() is called right before train()
+        def mark(self):
+            self.created = time.perf_counter()
+
+        def on_train_begin(self, args, state, control, **kwargs):
+            profiler.record_phase(setup_phase, time.perf_counter() - self.created, within="training")
+
+        def on_epoch_begin(self, args, state, control, **kwargs):
+            self.epoch_start = time.perf_counter()
+            self.epoch_step = state.global_step
+
+        def on_epoch_end(self, args, state, control, **kwargs):
+            batch_size = getattr(args, "train_batch_size", None) or getattr(args, "embedding_batch_size", None)
+            steps = state.global_step - self.epoch_step
+            profiler.record_phase("epoch", time.perf_counter() - self.epoch_start,
+                                  examples=steps * batch_size if batch_size else None, epoch=state.epoch, steps=steps,
+                                  within="training")
+
+    return EpochCallback()